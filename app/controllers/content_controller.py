@@ -1,14 +1,44 @@
 import os
-import json
+import re
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from pydantic_core import PydanticSerializationError
 from app.services.download_service import DownloadService
 from app.services.extraction_service import ExtractionService
 from app.services.gemini_service import GeminiService
 from app.services.excel_service import ExcelService
+from app.models.link_result_model import LinkResult
+from config.settings import MAX_CONCURRENT_LINKS, EXTRACT_AUDIO
 from config.logging_config import setup_logger
 
 logger = setup_logger(__name__)
 
+# Línea con un enlace: ignora líneas vacías y comentarios, y descarta espacios alrededor
+_LINK_RE = re.compile(r'^\s*(?!#)(\S.*?)\s*$')
+
+def _status_mark(success):
+    """Símbolo de estado para logs y resumen ('-' si el paso no se ejecutó)"""
+    if success is None:
+        return '-'
+    return '✓' if success else '✗'
+
+def _iter_links(file_path):
+    """
+    Lee los enlaces del archivo de forma perezosa, ignorando líneas vacías y comentarios
+    
+    Args:
+        file_path: Ruta al archivo de enlaces
+    
+    Yields:
+        str: URL de cada enlace
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            match = _LINK_RE.match(line)
+            if match:
+                yield match.group(1)
+
 class ContentController:
     """Controlador para la generación de contenido"""
     
@@ -19,7 +49,11 @@ class ContentController:
         self.excel_service = ExcelService()
         logger.debug("ContentController inicializado con servicios: download, extraction, gemini, excel")
     
-    def process_link(self, url, output_dir, index=1):
+    def close(self):
+        """Libera los recursos de los servicios (la caché de contexto de Gemini)"""
+        self.video_analysis_service.close()
+    
+    def process_link(self, url, output_dir, index=1, extract_audio=EXTRACT_AUDIO):
         """
         Procesa un enlace individual
         
@@ -27,11 +61,12 @@ class ContentController:
             url: URL del video
             output_dir: Directorio base de salida
             index: Índice del enlace (para nombrar archivos)
+            extract_audio: Si se debe guardar también el audio en MP3
         
         Returns:
-            dict: Resultados del procesamiento
+            LinkResult: Resultados del procesamiento
         """
-        logger.debug(f"Iniciando procesamiento del enlace #{index}: {url}")
+        logger.debug("Iniciando procesamiento del enlace #%s: %s", index, url)
         
         # Crear estructura de directorios
         content_dir = os.path.join(output_dir, f"archivo_{index}")
@@ -39,62 +74,69 @@ class ContentController:
         audio_path = os.path.join(content_dir, f"archivo_{index}_audio.mp3")
         captures_dir = os.path.join(content_dir, "capturas_del_video")
         
-        logger.debug(f"Rutas configuradas para archivo_{index}:")
-        logger.debug(f"  - Video: {video_path}")
-        logger.debug(f"  - Audio: {audio_path}")
-        logger.debug(f"  - Capturas: {captures_dir}")
+        logger.debug("Rutas configuradas para archivo_%s:", index)
+        logger.debug("  - Video: %s", video_path)
+        logger.debug("  - Audio: %s", audio_path)
+        logger.debug("  - Capturas: %s", captures_dir)
+        
+        # Crear los directorios una sola vez (makedirs crea también content_dir)
+        os.makedirs(captures_dir, exist_ok=True)
         
-        # Descargar video y audio
         logger.info(f"Procesando enlace #{index}: {url}")
-        video_success = self.download_service.download_video(url, video_path)
-        audio_success = self.download_service.extract_audio(url, audio_path)
+        if extract_audio:
+            # Descargar video y audio con una sola ejecución de yt-dlp
+            video_success, audio_success = self.download_service.download_video_and_audio(url, video_path, audio_path)
+        else:
+            # Ningún paso posterior usa el MP3: el análisis multimodal ya recibe el audio dentro del video
+            video_success = self.download_service.download_video(url, video_path)
+            audio_success = None
         
-        logger.debug(f"Resultado de descargas para archivo_{index}:")
-        logger.debug(f"  - Video: {'✓' if video_success else '✗'}")
-        logger.debug(f"  - Audio: {'✓' if audio_success else '✗'}")
+        logger.debug("Resultado de descargas para archivo_%s:", index)
+        logger.debug("  - Video: %s", '✓' if video_success else '✗')
+        logger.debug("  - Audio: %s", _status_mark(audio_success))
         
-        # Extraer frames si el video se descargó correctamente
         frames_success = False
-        if video_success:
-            logger.debug(f"Iniciando extracción de frames para archivo_{index}")
-            frames_success = self.extraction_service.extract_frames(video_path, captures_dir)
-            logger.debug(f"Extracción de frames: {'✓' if frames_success else '✗'}")
-        
-        # Análisis con LLM
         analysis = None
         if video_success:
-            logger.info(f"Iniciando análisis de video con modelo multimodal para archivo_{index}")
-            analysis = self.video_analysis_service.analyze_video(video_path)
+            # Análisis con LLM (red) y extracción de frames (CPU) en paralelo.
+            # El análisis se envía primero para que la petición salga cuanto antes.
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                logger.info(f"Iniciando análisis de video con modelo multimodal para archivo_{index}")
+                analysis_future = executor.submit(self.video_analysis_service.analyze_video, video_path)
+                
+                logger.debug("Iniciando extracción de frames para archivo_%s", index)
+                frames_future = executor.submit(self.extraction_service.extract_frames, video_path, captures_dir)
+                
+                frames_success = frames_future.result()
+                logger.debug("Extracción de frames: %s", '✓' if frames_success else '✗')
+                analysis = analysis_future.result()
             
             # Guardar el análisis en un archivo JSON
             if analysis:
                 analysis_path = os.path.join(content_dir, f"archivo_{index}_analysis.json")
-                with open(analysis_path, "w", encoding="utf-8") as f:
-                    try:
-                        # Intentar usar model_dump_json (Pydantic v2)
-                        json_str = analysis.model_dump_json(indent=2)
-                        f.write(json_str)
-                    except AttributeError:
-                        # Fallback a json.dumps (para cualquier versión de Pydantic)
-                        try:
-                            import json
-                            result_dict = analysis.dict() if hasattr(analysis, 'dict') else analysis.model_dump()
-                            f.write(json.dumps(result_dict, indent=2, ensure_ascii=False))
-                        except Exception as e:
-                            logger.error(f"Error al serializar el análisis: {e}")
-                            # Último recurso: convertir a string y guardar
-                            f.write(str(analysis))
-                logger.debug(f"Análisis guardado en: {analysis_path}")
+                # Serializar completo antes de abrir el archivo: una sola escritura y sin
+                # dejar un archivo a medias si la serialización falla
+                try:
+                    # El serializador de pydantic-core genera los bytes JSON directamente,
+                    # sin pasar por un dict intermedio
+                    payload = analysis.__pydantic_serializer__.to_json(analysis, indent=2)
+                except PydanticSerializationError as e:
+                    logger.error(f"Error al serializar el análisis: {e}")
+                    # Último recurso: convertir a string y guardar
+                    payload = str(analysis).encode("utf-8")
+                with open(analysis_path, "wb") as f:
+                    f.write(payload)
+                logger.debug("Análisis guardado en: %s", analysis_path)
             else:
                 logger.warning(f"No se pudo obtener análisis para archivo_{index}")
         
-        return {
-            "url": url,
-            "video_success": video_success,
-            "audio_success": audio_success,
-            "frames_success": frames_success,
-            "analysis": analysis
-        }
+        return LinkResult(
+            url=url,
+            video_success=video_success,
+            audio_success=audio_success,
+            frames_success=frames_success,
+            has_analysis=analysis is not None
+        )
     
     def process_links_file(self, file_path, output_dir):
         """
@@ -105,7 +147,7 @@ class ContentController:
             output_dir: Directorio base de salida
         
         Returns:
-            list: Resultados del procesamiento
+            List[LinkResult]: Resultados del procesamiento
         """
         logger.info(f"Iniciando procesamiento de archivo de enlaces: {file_path}")
         
@@ -114,44 +156,42 @@ class ContentController:
             return []
         
         if not os.path.exists(output_dir):
-            logger.debug(f"Creando directorio de salida: {output_dir}")
+            logger.debug("Creando directorio de salida: %s", output_dir)
             os.makedirs(output_dir)
 
         date_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         output_dir_with_date = os.path.join(output_dir, date_str)
-        logger.debug(f"Directorio de salida con fecha: {output_dir_with_date}")
-        
-        results = []
-        # Leer todas las líneas de una vez
-        with open(file_path, 'r') as file:
-            links = [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
-        
-        logger.info(f"Se encontraron {len(links)} enlaces para procesar")
+        logger.debug("Directorio de salida con fecha: %s", output_dir_with_date)
+        
+        # Procesar los enlaces en paralelo (descargas y llamadas a la API son I/O).
+        # Cada enlace se envía al pool en cuanto se lee del archivo.
+        indexed_results = []
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_LINKS) as executor:
+            futures = {
+                executor.submit(self.process_link, url, output_dir_with_date, i+1): i
+                for i, url in enumerate(_iter_links(file_path))
+            }
+            logger.info(f"Se encontraron {len(futures)} enlaces para procesar")
+            
+            for future in as_completed(futures):
+                indexed_results.append((futures[future], future.result()))
         
-        # Procesar cada enlace
-        for i, url in enumerate(links):
-            result = self.process_link(url, output_dir_with_date, i+1)
-            results.append(result)
+        # Mantener el orden original del archivo de enlaces
+        indexed_results.sort(key=lambda item: item[0])
+        results = [result for _, result in indexed_results]
         
         # Guardar los resultados en un archivo JSON
         results_file = os.path.join(output_dir_with_date, f"processing_results_{date_str}.json")
         try:
             # Convertir los resultados a un formato serializable
-            serializable_results = []
-            for result in results:
-                serializable_result = {
-                    "url": result["url"],
-                    "video_success": result["video_success"],
-                    "audio_success": result["audio_success"],
-                    "frames_success": result["frames_success"],
-                    # No incluimos el análisis completo porque ya está guardado en archivos individuales
-                    "has_analysis": result["analysis"] is not None
-                }
-                serializable_results.append(serializable_result)
-                
-            with open(results_file, 'w', encoding='utf-8') as f:
-                json.dump(serializable_results, f, indent=2, ensure_ascii=False)
-            logger.debug(f"Resultados guardados en: {results_file}")
+            serializable_results = [result._asdict() for result in results]
+            
+            # Generar el JSON completo en memoria y escribirlo de una vez
+            # (json.dump emitiría una escritura por cada elemento)
+            payload = orjson.dumps(serializable_results, option=orjson.OPT_INDENT_2)
+            with open(results_file, 'wb') as f:
+                f.write(payload)
+            logger.debug("Resultados guardados en: %s", results_file)
         except Exception as e:
             logger.error(f"Error al guardar los resultados: {e}")
         
@@ -176,25 +216,13 @@ class ContentController:
         Args:
             results: Lista de resultados de procesamiento
         """
-        logger.info("=== RESUMEN DE PROCESAMIENTO ===")
-        for i, result in enumerate(results):
-            status = []
-            if result["video_success"]:
-                status.append("Video ✓")
-            else:
-                status.append("Video ✗")
-                
-            if result["audio_success"]:
-                status.append("Audio ✓")
-            else:
-                status.append("Audio ✗")
-                
-            if result.get("frames_success"):
-                status.append("Frames ✓")
-            else:
-                status.append("Frames ✗")
-            
-            status_str = ', '.join(status)
-            logger.info(f"{i+1}. {result['url']}: {status_str}")
-            if result['analysis']:
-                logger.debug(f"Análisis para enlace #{i+1}: {result['analysis']}")
\ No newline at end of file
+        lines = [
+            "%d. %s: %s" % (i+1, result.url, ", ".join([
+                f"Video {'✓' if result.video_success else '✗'}",
+                f"Audio {_status_mark(result.audio_success)}",
+                f"Frames {'✓' if result.frames_success else '✗'}"
+            ]))
+            for i, result in enumerate(results)
+        ]
+        # Un único registro de log para todo el resumen
+        logger.info("=== RESUMEN DE PROCESAMIENTO ===\n%s", "\n".join(lines))
\ No newline at end of file
@@ -0,0 +1,14 @@
+from typing import NamedTuple, Optional
+
+__all__ = ["LinkResult"]
+
+class LinkResult(NamedTuple):
+    """Resultado del procesamiento de un enlace"""
+    
+    url: str
+    video_success: bool
+    # None cuando no se solicitó la extracción del audio
+    audio_success: Optional[bool]
+    frames_success: bool
+    # El análisis completo no se incluye porque ya está guardado en archivos individuales
+    has_analysis: bool
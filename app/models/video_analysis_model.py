@@ -1,6 +1,8 @@
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Dict, Optional, Tuple, Union, Literal
 
+__all__ = ["MusicRecommendation", "MusicInfo", "DialogInfo", "VideoAnalysis"]
+
 class MusicRecommendation(BaseModel):
     model_config = ConfigDict(extra='allow', populate_by_name=True)
     
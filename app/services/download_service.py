@@ -1,6 +1,10 @@
-import subprocess
 import os
 import shutil
+import warnings
+from functools import lru_cache
+from typing import Tuple
+from yt_dlp import YoutubeDL, parse_options
+from yt_dlp.utils import DownloadError
 from config.settings import (
     USER_AGENT, 
     INSTAGRAM_USERNAME, 
@@ -13,131 +17,216 @@ from config.logging_config import setup_logger
 
 logger = setup_logger(__name__)
 
+@lru_cache(maxsize=1)
+def _instagram_auth_args() -> Tuple[str, ...]:
+    """
+    Determina una única vez los argumentos de autenticación de yt-dlp para Instagram
+    
+    Returns:
+        Tuple[str, ...]: Argumentos a añadir al comando (vacío si no hay credenciales)
+    """
+    # Método 1: Usar archivo de cookies si existe
+    if os.path.exists(INSTAGRAM_COOKIES_FILE):
+        logger.debug("Usando archivo de cookies: %s", INSTAGRAM_COOKIES_FILE)
+        return ("--cookies", INSTAGRAM_COOKIES_FILE)
+    
+    # Método 2: Usar nombre de usuario y contraseña
+    if INSTAGRAM_USERNAME and INSTAGRAM_PASSWORD:
+        logger.debug("Usando credenciales de usuario y contraseña")
+        return ("--username", INSTAGRAM_USERNAME, "--password", INSTAGRAM_PASSWORD)
+    
+    # Método 3: Usar cookies del navegador (puede fallar por permisos)
+    if INSTAGRAM_BROWSER and INSTAGRAM_BROWSER.lower() in ["chrome", "firefox", "safari", "edge", "opera"]:
+        logger.debug("Usando cookies del navegador %s", INSTAGRAM_BROWSER)
+        if INSTAGRAM_PROFILE:
+            return ("--cookies-from-browser", f"{INSTAGRAM_BROWSER}:{INSTAGRAM_PROFILE}")
+        return ("--cookies-from-browser", INSTAGRAM_BROWSER)
+    
+    # Si no hay credenciales configuradas, advertir
+    logger.warning("No se han configurado credenciales para Instagram. Es posible que la descarga falle.")
+    return ()
+
 class DownloadService:
     """Servicio para descargar videos y audio de plataformas sociales"""
     
     @staticmethod
-    def download_video(url, output_path):
+    def _run_yt_dlp(url, ydl_opts):
         """
-        Descarga un video desde una URL
+        Ejecuta yt-dlp dentro del propio proceso
         
         Args:
             url: URL del video
-            output_path: Ruta donde guardar el video
+            ydl_opts: Opciones de YoutubeDL
         
         Returns:
-            bool: True si la descarga fue exitosa, False en caso contrario
+            Tuple[bool, str]: Éxito de la operación y mensaje de error (vacío si tuvo éxito)
+        """
+        # Las opciones del CLI traen ignoreerrors='only_download', con el que yt-dlp solo registra
+        # los fallos y download() devuelve 1; sin él lanza DownloadError con el motivo del error
+        try:
+            with YoutubeDL(dict(ydl_opts, logger=logger, noprogress=True, ignoreerrors=False)) as ydl:
+                retcode = ydl.download([url])
+            return retcode == 0, ""
+        except DownloadError as e:
+            return False, str(e)
+        except Exception as e:
+            # Errores previos a la descarga (p. ej. al cargar cookies del navegador)
+            return False, f"{type(e).__name__}: {str(e)}"
+    
+    @staticmethod
+    def _run_with_fallback(url, cmd, action, success_msg, error_msg):
         """
-        logger.debug(f"Iniciando descarga de video: {url}")
-        logger.debug(f"Ruta de salida: {output_path}")
+        Ejecuta yt-dlp y, si falla con una URL de Instagram, reintenta con métodos alternativos
         
-        # Crear directorio si no existe
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        logger.debug(f"Directorio de salida asegurado: {os.path.dirname(output_path)}")
+        Los argumentos se interpretan una sola vez; los reintentos solo cambian las
+        opciones de autenticación sobre las mismas opciones de YoutubeDL.
         
-        # Comando base
+        Args:
+            url: URL del video
+            cmd: Comando de yt-dlp (con credenciales si corresponde)
+            action: Nombre de la operación (para los mensajes de log)
+            success_msg: Mensaje a registrar si la operación tiene éxito
+            error_msg: Mensaje a registrar si la operación falla
+        
+        Returns:
+            bool: True si la operación fue exitosa, False en caso contrario
+        """
+        logger.debug("Comando de %s: %s", action, cmd)
+        
+        # parse_options traduce los argumentos a las opciones de YoutubeDL con la misma semántica que el CLI
+        ydl_opts = parse_options(cmd[1:]).ydl_opts
+        success, error = DownloadService._run_yt_dlp(url, ydl_opts)
+        
+        if success:
+            logger.info(success_msg)
+            return success
+        
+        logger.error(f"{error_msg}: {error}")
+        
+        # Intentar con método alternativo si falló
+        if "instagram.com" in url and ("error has occurred" in error.lower() or "permission denied" in error.lower()):
+            logger.info(f"Intentando método alternativo de {action} para Instagram")
+            
+            # Si falló con cookies del navegador, intentar con credenciales
+            if ydl_opts.get("cookiesfrombrowser") and INSTAGRAM_USERNAME and INSTAGRAM_PASSWORD:
+                logger.debug("Cambiando a autenticación por usuario/contraseña")
+                alt_opts = dict(ydl_opts, cookiesfrombrowser=None, username=INSTAGRAM_USERNAME, password=INSTAGRAM_PASSWORD)
+                success, alt_error = DownloadService._run_yt_dlp(url, alt_opts)
+                
+                if success:
+                    logger.info(f"{success_msg} (método alternativo)")
+                else:
+                    logger.error(f"{error_msg} con método alternativo: {alt_error}")
+            
+            # Si falló con credenciales o cookies del navegador, intentar sin autenticación
+            else:
+                logger.debug("Intentando %s sin autenticación", action)
+                basic_opts = dict(ydl_opts, cookiefile=None, cookiesfrombrowser=None, username=None, password=None)
+                success, basic_error = DownloadService._run_yt_dlp(url, basic_opts)
+                
+                if success:
+                    logger.info(f"{success_msg} (sin autenticación)")
+                else:
+                    logger.error(f"{error_msg} sin autenticación: {basic_error}")
+        
+        return success
+    
+    @staticmethod
+    def download_video_and_audio(url, video_path, audio_path):
+        """
+        Descarga un video y extrae su audio con una única ejecución de yt-dlp
+        
+        Args:
+            url: URL del video
+            video_path: Ruta donde guardar el video
+            audio_path: Ruta donde guardar el audio (mp3)
+        
+        Returns:
+            Tuple[bool, bool]: Éxito de la descarga del video y de la extracción del audio
+        """
+        logger.debug("Iniciando descarga de video y audio: %s", url)
+        logger.debug("Rutas de salida: %s, %s", video_path, audio_path)
+        
+        # yt-dlp conserva el video (--keep-video) y deja el audio junto a él con extensión .mp3
         cmd = [
             "yt-dlp", 
             url,
-            "-f", "b",  # Usar 'b' en lugar de 'best' para evitar advertencias
+            "-f", "b",
+            "--keep-video",
+            "--extract-audio",
+            "--audio-format", "mp3",
+            "--audio-quality", "0",
             "--no-check-certificate",
             "--user-agent", USER_AGENT,
-            "-o", output_path
+            "-o", video_path
         ]
         
-        # Añadir credenciales si es una URL de Instagram
         if "instagram.com" in url:
-            logger.debug("Detectada URL de Instagram, añadiendo credenciales")
-            
-            # Método 1: Usar archivo de cookies si existe
-            if os.path.exists(INSTAGRAM_COOKIES_FILE):
-                logger.debug(f"Usando archivo de cookies: {INSTAGRAM_COOKIES_FILE}")
-                cmd.extend(["--cookies", INSTAGRAM_COOKIES_FILE])
-            
-            # Método 2: Usar nombre de usuario y contraseña
-            elif INSTAGRAM_USERNAME and INSTAGRAM_PASSWORD:
-                logger.debug("Usando credenciales de usuario y contraseña")
-                cmd.extend(["--username", INSTAGRAM_USERNAME, "--password", INSTAGRAM_PASSWORD])
-            
-            # Método 3: Usar cookies del navegador (puede fallar por permisos)
-            elif INSTAGRAM_BROWSER and INSTAGRAM_BROWSER.lower() in ["chrome", "firefox", "safari", "edge", "opera"]:
-                try:
-                    logger.debug(f"Usando cookies del navegador {INSTAGRAM_BROWSER}")
-                    if INSTAGRAM_PROFILE:
-                        cmd.extend(["--cookies-from-browser", f"{INSTAGRAM_BROWSER}:{INSTAGRAM_PROFILE}"])
-                    else:
-                        cmd.extend(["--cookies-from-browser", INSTAGRAM_BROWSER])
-                except Exception as e:
-                    logger.warning(f"Error al acceder a cookies del navegador: {str(e)}")
-                    # Fallback a credenciales si hay error con cookies
-                    if INSTAGRAM_USERNAME and INSTAGRAM_PASSWORD:
-                        logger.debug("Fallback a credenciales de usuario y contraseña")
-                        cmd = [item for item in cmd if item not in ["--cookies-from-browser", f"{INSTAGRAM_BROWSER}:{INSTAGRAM_PROFILE}", INSTAGRAM_BROWSER]]
-                        cmd.extend(["--username", INSTAGRAM_USERNAME, "--password", INSTAGRAM_PASSWORD])
-            
-            # Si no hay credenciales configuradas, advertir
-            else:
-                logger.warning("No se han configurado credenciales para Instagram. Es posible que la descarga falle.")
+            cmd.extend(_instagram_auth_args())
+        success = DownloadService._run_with_fallback(
+            url, cmd, "descarga",
+            f"Video y audio descargados exitosamente: {video_path}",
+            "Error al descargar video y audio"
+        )
         
-        logger.debug(f"Comando de descarga: {' '.join(cmd)}")
+        if not success:
+            return False, False
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        success = result.returncode == 0
+        video_success = os.path.exists(video_path)
         
-        if success:
-            logger.info(f"Video descargado exitosamente: {output_path}")
+        # Mover el audio derivado a la ruta solicitada
+        derived_audio_path = f"{os.path.splitext(video_path)[0]}.mp3"
+        audio_success = False
+        if os.path.exists(derived_audio_path):
+            if derived_audio_path != audio_path:
+                shutil.move(derived_audio_path, audio_path)
+            audio_success = True
+            logger.debug("Audio guardado en: %s", audio_path)
         else:
-            logger.error(f"Error al descargar video: {result.stderr}")
-            logger.debug(f"Código de salida: {result.returncode}")
-            logger.debug(f"Salida de error: {result.stderr}")
-            
-            # Intentar con método alternativo si falló
-            if "instagram.com" in url and ("error has occurred" in result.stderr.lower() or "permission denied" in result.stderr.lower()):
-                logger.info("Intentando método alternativo de descarga para Instagram")
-                
-                # Si falló con cookies del navegador, intentar con credenciales
-                if "--cookies-from-browser" in ' '.join(cmd) and INSTAGRAM_USERNAME and INSTAGRAM_PASSWORD:
-                    logger.debug("Cambiando a autenticación por usuario/contraseña")
-                    alt_cmd = [item for item in cmd if item not in ["--cookies-from-browser", f"{INSTAGRAM_BROWSER}:{INSTAGRAM_PROFILE}", INSTAGRAM_BROWSER]]
-                    alt_cmd.extend(["--username", INSTAGRAM_USERNAME, "--password", INSTAGRAM_PASSWORD])
-                    
-                    logger.debug(f"Comando alternativo: {' '.join(alt_cmd)}")
-                    alt_result = subprocess.run(alt_cmd, capture_output=True, text=True)
-                    success = alt_result.returncode == 0
-                    
-                    if success:
-                        logger.info(f"Video descargado exitosamente con método alternativo: {output_path}")
-                    else:
-                        logger.error(f"Error al descargar video con método alternativo: {alt_result.stderr}")
-                
-                # Si falló con credenciales o cookies del navegador, intentar sin autenticación
-                elif not success:
-                    logger.debug("Intentando descarga sin autenticación")
-                    basic_cmd = [
-                        "yt-dlp", 
-                        url,
-                        "-f", "b",
-                        "--no-check-certificate",
-                        "--user-agent", USER_AGENT,
-                        "-o", output_path
-                    ]
-                    
-                    logger.debug(f"Comando básico: {' '.join(basic_cmd)}")
-                    basic_result = subprocess.run(basic_cmd, capture_output=True, text=True)
-                    success = basic_result.returncode == 0
-                    
-                    if success:
-                        logger.info(f"Video descargado exitosamente sin autenticación: {output_path}")
-                    else:
-                        logger.error(f"Error al descargar video sin autenticación: {basic_result.stderr}")
+            logger.error(f"No se encontró el audio extraído: {derived_audio_path}")
         
-        return success
+        return video_success, audio_success
+    
+    @staticmethod
+    def download_video(url, output_path):
+        """
+        Descarga un video desde una URL (sin extraer el audio)
+        
+        Args:
+            url: URL del video
+            output_path: Ruta donde guardar el video
+        
+        Returns:
+            bool: True si la descarga fue exitosa, False en caso contrario
+        """
+        logger.debug("Iniciando descarga de video: %s", url)
+        logger.debug("Ruta de salida: %s", output_path)
+        
+        # Comando base
+        cmd = [
+            "yt-dlp", 
+            url,
+            "-f", "b",  # Usar 'b' en lugar de 'best' para evitar advertencias
+            "--no-check-certificate",
+            "--user-agent", USER_AGENT,
+            "-o", output_path
+        ]
+        
+        if "instagram.com" in url:
+            cmd.extend(_instagram_auth_args())
+        return DownloadService._run_with_fallback(
+            url, cmd, "descarga",
+            f"Video descargado exitosamente: {output_path}",
+            "Error al descargar video"
+        )
     
     @staticmethod
     def extract_audio(url, output_path):
         """
         Extrae el audio de un video desde una URL
         
+        Obsoleto: usar download_video_and_audio, que obtiene video y audio con una sola ejecución de yt-dlp.
+        
         Args:
             url: URL del video
             output_path: Ruta donde guardar el audio
@@ -145,12 +234,13 @@ class DownloadService:
         Returns:
             bool: True si la extracción fue exitosa, False en caso contrario
         """
-        logger.debug(f"Iniciando extracción de audio: {url}")
-        logger.debug(f"Ruta de salida: {output_path}")
-        
-        # Crear directorio si no existe
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        logger.debug(f"Directorio de salida asegurado: {os.path.dirname(output_path)}")
+        warnings.warn(
+            "extract_audio está obsoleto, usar download_video_and_audio",
+            DeprecationWarning,
+            stacklevel=2
+        )
+        logger.debug("Iniciando extracción de audio: %s", url)
+        logger.debug("Ruta de salida: %s", output_path)
         
         # Asegurar que la extensión sea correcta
         base_path = output_path.replace(".mp3", "")
@@ -167,92 +257,10 @@ class DownloadService:
             "-o", f"{base_path}.%(ext)s"
         ]
         
-        # Añadir credenciales si es una URL de Instagram
         if "instagram.com" in url:
-            logger.debug("Detectada URL de Instagram, añadiendo credenciales")
-            
-            # Método 1: Usar archivo de cookies si existe
-            if os.path.exists(INSTAGRAM_COOKIES_FILE):
-                logger.debug(f"Usando archivo de cookies: {INSTAGRAM_COOKIES_FILE}")
-                cmd.extend(["--cookies", INSTAGRAM_COOKIES_FILE])
-            
-            # Método 2: Usar nombre de usuario y contraseña
-            elif INSTAGRAM_USERNAME and INSTAGRAM_PASSWORD:
-                logger.debug("Usando credenciales de usuario y contraseña")
-                cmd.extend(["--username", INSTAGRAM_USERNAME, "--password", INSTAGRAM_PASSWORD])
-            
-            # Método 3: Usar cookies del navegador (puede fallar por permisos)
-            elif INSTAGRAM_BROWSER and INSTAGRAM_BROWSER.lower() in ["chrome", "firefox", "safari", "edge", "opera"]:
-                try:
-                    logger.debug(f"Usando cookies del navegador {INSTAGRAM_BROWSER}")
-                    if INSTAGRAM_PROFILE:
-                        cmd.extend(["--cookies-from-browser", f"{INSTAGRAM_BROWSER}:{INSTAGRAM_PROFILE}"])
-                    else:
-                        cmd.extend(["--cookies-from-browser", INSTAGRAM_BROWSER])
-                except Exception as e:
-                    logger.warning(f"Error al acceder a cookies del navegador: {str(e)}")
-                    # Fallback a credenciales si hay error con cookies
-                    if INSTAGRAM_USERNAME and INSTAGRAM_PASSWORD:
-                        logger.debug("Fallback a credenciales de usuario y contraseña")
-                        cmd = [item for item in cmd if item not in ["--cookies-from-browser", f"{INSTAGRAM_BROWSER}:{INSTAGRAM_PROFILE}", INSTAGRAM_BROWSER]]
-                        cmd.extend(["--username", INSTAGRAM_USERNAME, "--password", INSTAGRAM_PASSWORD])
-            
-            # Si no hay credenciales configuradas, advertir
-            else:
-                logger.warning("No se han configurado credenciales para Instagram. Es posible que la extracción falle.")
-        
-        logger.debug(f"Comando de extracción: {' '.join(cmd)}")
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        success = result.returncode == 0
-        
-        if success:
-            logger.info(f"Audio extraído exitosamente: {output_path}")
-        else:
-            logger.error(f"Error al extraer audio: {result.stderr}")
-            logger.debug(f"Código de salida: {result.returncode}")
-            logger.debug(f"Salida de error: {result.stderr}")
-            
-            # Intentar con método alternativo si falló
-            if "instagram.com" in url and ("error has occurred" in result.stderr.lower() or "permission denied" in result.stderr.lower()):
-                logger.info("Intentando método alternativo de extracción para Instagram")
-                
-                # Si falló con cookies del navegador, intentar con credenciales
-                if "--cookies-from-browser" in ' '.join(cmd) and INSTAGRAM_USERNAME and INSTAGRAM_PASSWORD:
-                    logger.debug("Cambiando a autenticación por usuario/contraseña")
-                    alt_cmd = [item for item in cmd if item not in ["--cookies-from-browser", f"{INSTAGRAM_BROWSER}:{INSTAGRAM_PROFILE}", INSTAGRAM_BROWSER]]
-                    alt_cmd.extend(["--username", INSTAGRAM_USERNAME, "--password", INSTAGRAM_PASSWORD])
-                    
-                    logger.debug(f"Comando alternativo: {' '.join(alt_cmd)}")
-                    alt_result = subprocess.run(alt_cmd, capture_output=True, text=True)
-                    success = alt_result.returncode == 0
-                    
-                    if success:
-                        logger.info(f"Audio extraído exitosamente con método alternativo: {output_path}")
-                    else:
-                        logger.error(f"Error al extraer audio con método alternativo: {alt_result.stderr}")
-                
-                # Si falló con credenciales o cookies del navegador, intentar sin autenticación
-                elif not success:
-                    logger.debug("Intentando extracción sin autenticación")
-                    basic_cmd = [
-                        "yt-dlp", 
-                        url,
-                        "--extract-audio",
-                        "--audio-format", "mp3",
-                        "--audio-quality", "0",
-                        "--no-check-certificate",
-                        "--user-agent", USER_AGENT,
-                        "-o", f"{base_path}.%(ext)s"
-                    ]
-                    
-                    logger.debug(f"Comando básico: {' '.join(basic_cmd)}")
-                    basic_result = subprocess.run(basic_cmd, capture_output=True, text=True)
-                    success = basic_result.returncode == 0
-                    
-                    if success:
-                        logger.info(f"Audio extraído exitosamente sin autenticación: {output_path}")
-                    else:
-                        logger.error(f"Error al extraer audio sin autenticación: {basic_result.stderr}")
-        
-        return success 
\ No newline at end of file
+            cmd.extend(_instagram_auth_args())
+        return DownloadService._run_with_fallback(
+            url, cmd, "extracción",
+            f"Audio extraído exitosamente: {output_path}",
+            "Error al extraer audio"
+        )
@@ -1,12 +1,83 @@
 import os
-import json
 import shutil
-import pandas as pd
+import subprocess
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
+import xlsxwriter
 from config.logging_config import setup_logger
 
 logger = setup_logger(__name__)
 
+# ijson es opcional: permite recorrer el archivo de resultados sin cargarlo entero en memoria
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+def _iter_processing_results(results_file):
+    """
+    Recorre los resultados del procesamiento uno a uno
+    
+    Args:
+        results_file: Ruta al archivo processing_results_*.json
+    
+    Yields:
+        Any: Cada elemento de la lista de resultados
+    """
+    if ijson is not None:
+        # ijson trabaja mejor sobre el archivo en binario
+        with open(results_file, 'rb') as f:
+            yield from ijson.items(f, 'item')
+    else:
+        with open(results_file, 'rb') as f:
+            yield from orjson.loads(f.read())
+
+# Número de hilos para eliminar en paralelo el contenido de un directorio
+CLEANUP_WORKERS = 8
+
+def _remove_tree(path):
+    """
+    Elimina una carpeta con todo su contenido
+    
+    Usa el comando nativo del sistema (rm -rf / rd /s /q), mucho más rápido que shutil.rmtree
+    en carpetas con muchos archivos pequeños como las capturas; si no está disponible o
+    falla, recurre a shutil.rmtree.
+    
+    Args:
+        path: Ruta a la carpeta
+    """
+    if os.name == 'posix':
+        cmd = ['rm', '-rf', '--', path]
+    else:
+        cmd = ['cmd', '/c', 'rd', '/s', '/q', path]
+    
+    try:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode == 0 and not os.path.exists(path):
+            return
+    except OSError as e:
+        logger.debug(f"No se pudo ejecutar {cmd[0]}, se usará shutil.rmtree: {str(e)}")
+    
+    shutil.rmtree(path)
+
+def _remove_entry(entry):
+    """
+    Elimina un archivo o una carpeta, registrando el error si falla
+    
+    Args:
+        entry: os.DirEntry a eliminar
+    """
+    try:
+        if entry.is_dir(follow_symlinks=False):
+            logger.debug(f"Eliminando directorio: {entry.path}")
+            _remove_tree(entry.path)
+        else:
+            logger.debug(f"Eliminando archivo: {entry.path}")
+            os.remove(entry.path)
+    except Exception as e:
+        logger.error(f"Error al eliminar {entry.path}: {str(e)}")
+
 class ExcelService:
     """Servicio para generar archivos Excel a partir de análisis JSON"""
     
@@ -28,31 +99,19 @@ class ExcelService:
         try:
             logger.info(f"Iniciando limpieza del directorio: {date_path}")
             
-            # Obtener la lista de todos los elementos en el directorio
-            items = os.listdir(date_path)
-            
             # Nombre del archivo Excel (sin la ruta)
             excel_filename = os.path.basename(excel_file)
             
-            # Eliminar todos los elementos excepto el archivo Excel
-            for item in items:
-                item_path = os.path.join(date_path, item)
-                
-                # Conservar solo el archivo Excel
-                if item == excel_filename:
-                    logger.debug(f"Conservando archivo Excel: {item_path}")
-                    continue
-                
-                # Eliminar el resto de archivos y carpetas
-                try:
-                    if os.path.isdir(item_path):
-                        logger.debug(f"Eliminando directorio: {item_path}")
-                        shutil.rmtree(item_path)
-                    else:
-                        logger.debug(f"Eliminando archivo: {item_path}")
-                        os.remove(item_path)
-                except Exception as e:
-                    logger.error(f"Error al eliminar {item_path}: {str(e)}")
+            # Obtener todos los elementos del directorio excepto el archivo Excel
+            # (scandir ya informa del tipo de cada entrada, sin un stat adicional)
+            with os.scandir(date_path) as it:
+                targets = [item for item in it if item.name != excel_filename]
+            logger.debug(f"Conservando archivo Excel: {excel_file}")
+            
+            # Eliminar el resto de archivos y carpetas en paralelo: son operaciones de
+            # metadatos del sistema de archivos que pasan casi todo el tiempo esperando E/S
+            with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+                list(executor.map(_remove_entry, targets))
             
             logger.info(f"Limpieza completada para el directorio: {date_path}")
             return True
@@ -79,7 +138,8 @@ class ExcelService:
             return False
         
         # Buscar carpetas de fecha en el directorio de salida
-        date_dirs = [d for d in os.listdir(output_dir) if os.path.isdir(os.path.join(output_dir, d))]
+        with os.scandir(output_dir) as it:
+            date_dirs = [entry for entry in it if entry.is_dir()]
         
         if not date_dirs:
             logger.warning(f"No se encontraron carpetas de fecha en {output_dir}")
@@ -88,12 +148,20 @@ class ExcelService:
         excel_generated = False
         
         # Procesar cada carpeta de fecha
-        for date_dir in date_dirs:
-            date_path = os.path.join(output_dir, date_dir)
+        for date_entry in date_dirs:
+            date_dir = date_entry.name
+            date_path = date_entry.path
             logger.debug(f"Procesando carpeta de fecha: {date_path}")
             
-            # Buscar carpetas de archivos en la carpeta de fecha
-            file_dirs = [d for d in os.listdir(date_path) if os.path.isdir(os.path.join(date_path, d))]
+            # Buscar carpetas de archivos y el archivo de resultados en un solo recorrido
+            file_dirs = []
+            results_files = []
+            with os.scandir(date_path) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        file_dirs.append(entry)
+                    elif entry.name.startswith('processing_results_') and entry.name.endswith('.json'):
+                        results_files.append(entry.path)
             
             if not file_dirs:
                 logger.warning(f"No se encontraron carpetas de archivos en {date_path}")
@@ -101,20 +169,16 @@ class ExcelService:
             
             # Buscar el archivo de resultados del procesamiento
             results_data = {}
-            results_files = [f for f in os.listdir(date_path) if f.startswith('processing_results_') and f.endswith('.json')]
             
             if results_files:
-                results_file = os.path.join(date_path, results_files[0])
+                results_file = results_files[0]
                 logger.debug(f"Encontrado archivo de resultados: {results_file}")
                 
                 try:
-                    with open(results_file, 'r', encoding='utf-8') as f:
-                        processing_results = json.load(f)
-                        
                     # Crear un diccionario con las URLs indexadas por número de archivo
-                    for i, result in enumerate(processing_results):
+                    for i, result in enumerate(_iter_processing_results(results_file), start=1):
                         if isinstance(result, dict) and 'url' in result:
-                            results_data[i+1] = result['url']
+                            results_data[i] = result['url']
                             
                     logger.debug(f"Cargadas {len(results_data)} URLs de videos originales")
                 except Exception as e:
@@ -124,14 +188,18 @@ class ExcelService:
             
             # Recopilar datos para el Excel
             excel_data = []
+            # Columnas en orden de aparición, con url_video_original como la primera
+            seen_cols = {'url_video_original': None}
             
             # Procesar cada carpeta de archivo
-            for file_dir in file_dirs:
-                file_path = os.path.join(date_path, file_dir)
+            for file_entry in file_dirs:
+                file_dir = file_entry.name
+                file_path = file_entry.path
                 logger.debug(f"Procesando carpeta de archivo: {file_path}")
                 
                 # Buscar el archivo de análisis JSON
-                analysis_files = [f for f in os.listdir(file_path) if f.endswith('_analysis.json')]
+                with os.scandir(file_path) as it:
+                    analysis_files = [entry.path for entry in it if entry.name.endswith('_analysis.json')]
                 
                 if not analysis_files:
                     logger.warning(f"No se encontró archivo de análisis en {file_path}")
@@ -145,12 +213,12 @@ class ExcelService:
                     index = 0
                 
                 # Leer el archivo de análisis
-                analysis_file = os.path.join(file_path, analysis_files[0])
+                analysis_file = analysis_files[0]
                 logger.debug(f"Leyendo archivo de análisis: {analysis_file}")
                 
                 try:
-                    with open(analysis_file, 'r', encoding='utf-8') as f:
-                        analysis_data = json.load(f)
+                    with open(analysis_file, 'rb') as f:
+                        analysis_data = orjson.loads(f.read())
                     
                     # Crear un diccionario con los datos para el Excel
                     row_data = {}
@@ -165,11 +233,13 @@ class ExcelService:
                     for key, value in analysis_data.items():
                         # Si el valor es un diccionario o lista, lo convertimos a string JSON
                         if isinstance(value, (dict, list)):
-                            row_data[key] = json.dumps(value, ensure_ascii=False)
+                            row_data[key] = orjson.dumps(value).decode()
                         else:
                             row_data[key] = value
                     
                     excel_data.append(row_data)
+                    for key in row_data:
+                        seen_cols.setdefault(key, None)
                     
                 except Exception as e:
                     logger.error(f"Error al procesar el archivo {analysis_file}: {str(e)}")
@@ -181,15 +251,15 @@ class ExcelService:
                 logger.info(f"Generando archivo Excel: {excel_file}")
                 
                 try:
-                    # Crear DataFrame y guardar como Excel
-                    df = pd.DataFrame(excel_data)
-                    
-                    # Reordenar columnas para que url_video_original sea la primera
-                    cols = ['url_video_original'] + [col for col in df.columns if col != 'url_video_original']
-                    df = df[cols]
+                    cols = list(seen_cols)
                     
-                    # Guardar como Excel
-                    df.to_excel(excel_file, index=False, engine='openpyxl')
+                    # Guardar como Excel fila a fila; constant_memory vuelca cada fila a disco al pasar a la siguiente
+                    wb = xlsxwriter.Workbook(excel_file, {'constant_memory': True, 'strings_to_urls': False})
+                    ws = wb.add_worksheet()
+                    ws.write_row(0, 0, cols)
+                    for i, row_data in enumerate(excel_data, start=1):
+                        ws.write_row(i, 0, [row_data.get(col) for col in cols])
+                    wb.close()
                     logger.info(f"Archivo Excel generado exitosamente: {excel_file}")
                     excel_generated = True
                     
@@ -1,10 +1,50 @@
 import os
+import subprocess
 import cv2
+import numpy as np
 from config.settings import CAPTURE_INTERVAL
 from config.logging_config import setup_logger
+from app.services.ffmpeg_service import FFmpegService
 
 logger = setup_logger(__name__)
 
+# Calidad JPEG de las capturas de OpenCV (por defecto 95); 80 es suficiente para el análisis y codifica más rápido
+_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 80, cv2.IMWRITE_JPEG_OPTIMIZE, 0]
+
+# Distancia de Hamming mínima entre hashes para considerar distintas dos capturas consecutivas
+_DUPLICATE_HASH_DISTANCE = 6
+
+def _average_hash(frame):
+    """
+    Calcula el hash medio (aHash) de 64 bits de un frame
+    
+    Args:
+        frame: Imagen BGR
+    
+    Returns:
+        int: Hash de la imagen reducida a 8x8 en escala de grises
+    """
+    small = cv2.resize(frame, (8, 8), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    bits = (gray > gray.mean()).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def _is_frame_file(name):
+    """Indica si el nombre corresponde a una captura generada por la extracción"""
+    return name.startswith("frame_") and name.endswith(".jpg")
+
+def _remove_frames(output_dir):
+    """
+    Elimina las capturas existentes en el directorio (de una ejecución anterior o de un intento fallido)
+    
+    Args:
+        output_dir: Directorio de las capturas
+    """
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            if entry.is_file() and _is_frame_file(entry.name):
+                os.remove(entry.path)
+
 class ExtractionService:
     """Servicio para extraer contenido de videos"""
     
@@ -15,7 +55,7 @@ class ExtractionService:
         
         Args:
             video_path: Ruta al archivo de video
-            output_dir: Directorio donde guardar las capturas
+            output_dir: Directorio (ya existente) donde guardar las capturas
         
         Returns:
             bool: True si la extracción fue exitosa, False en caso contrario
@@ -24,15 +64,82 @@ class ExtractionService:
         logger.debug(f"Directorio de salida: {output_dir}")
         logger.debug(f"Intervalo de captura: {CAPTURE_INTERVAL} segundos")
         
-        # Crear directorio para las capturas si no existe
-        os.makedirs(output_dir, exist_ok=True)
-        logger.debug(f"Directorio de capturas asegurado: {output_dir}")
+        logger.info(f"Extrayendo frames cada {CAPTURE_INTERVAL} segundos...")
+        
+        # Partir de un directorio sin capturas para que el recuento solo incluya las de esta ejecución
+        _remove_frames(output_dir)
+        
+        # Una sola ejecución de FFmpeg para todas las capturas; OpenCV como alternativa
+        frame_count = ExtractionService._extract_frames_ffmpeg(video_path, output_dir)
+        if frame_count is None:
+            # Descartar las capturas parciales que haya dejado FFmpeg
+            _remove_frames(output_dir)
+            frame_count = ExtractionService._extract_frames_opencv(video_path, output_dir)
+            if frame_count is None:
+                return False
+        
+        logger.info(f"Extracción completada. Se extrajeron {frame_count} frames")
+        return True
+    
+    @staticmethod
+    def _extract_frames_ffmpeg(video_path, output_dir):
+        """
+        Extrae un frame cada CAPTURE_INTERVAL segundos con una única invocación de FFmpeg
+        
+        Args:
+            video_path: Ruta al archivo de video
+            output_dir: Directorio donde guardar las capturas
+        
+        Returns:
+            int: Número de frames extraídos, o None si FFmpeg falló
+        """
+        cmd = [
+            "ffmpeg", "-y",
+            "-loglevel", "error",
+            "-threads", "0",
+            "-i", video_path,
+            # mpdecimate descarta las capturas casi idénticas a la anterior (planos estáticos)
+            "-vf", f"fps=1/{CAPTURE_INTERVAL},mpdecimate",
+            "-vsync", "vfr",
+            "-q:v", "3",
+            "-start_number", "0",
+            os.path.join(output_dir, "frame_%03d.jpg")
+        ]
+        logger.debug("Comando de extracción de frames: %s", cmd)
+        
+        try:
+            result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError as e:
+            logger.warning(f"No se pudo ejecutar FFmpeg, se usará OpenCV: {str(e)}")
+            return None
+        
+        if result.returncode != 0:
+            logger.warning(f"FFmpeg falló al extraer frames, se usará OpenCV: {FFmpegService.stderr_tail(result.stderr)}")
+            return None
+        
+        return sum(1 for name in os.listdir(output_dir) if _is_frame_file(name))
+    
+    @staticmethod
+    def _extract_frames_opencv(video_path, output_dir):
+        """
+        Extrae un frame cada CAPTURE_INTERVAL segundos con OpenCV, recorriendo el video de forma secuencial
+        
+        grab() avanza sin reconstruir la imagen y retrieve() solo decodifica los frames
+        a capturar; así se evita posicionarse con set(), que salta al keyframe más
+        cercano y devuelve frames incorrectos en videos con FPS variable.
+        
+        Args:
+            video_path: Ruta al archivo de video
+            output_dir: Directorio donde guardar las capturas
         
+        Returns:
+            int: Número de frames extraídos, o None si no se pudo abrir el video
+        """
         # Abrir el video
         video = cv2.VideoCapture(video_path)
         if not video.isOpened():
             logger.error(f"Error: No se pudo abrir el video {video_path}")
-            return False
+            return None
         
         # Obtener FPS y duración del video
         fps = video.get(cv2.CAP_PROP_FPS)
@@ -45,27 +152,32 @@ class ExtractionService:
         logger.debug(f"  - Duración: {duration:.2f} segundos")
         
         # Calcular en qué frames hacer las capturas
-        frame_interval = int(fps * CAPTURE_INTERVAL)
+        frame_interval = max(1, int(fps * CAPTURE_INTERVAL))
+        targets = iter(range(0, total_frames, frame_interval))
+        next_capture = next(targets, None)
         current_frame = 0
         frame_count = 0
+        last_hash = None
         
-        logger.info(f"Extrayendo frames cada {CAPTURE_INTERVAL} segundos...")
-        
-        while current_frame < total_frames:
-            video.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
-            ret, frame = video.read()
-            
-            if ret:
-                # Guardar el frame como imagen
-                output_path = os.path.join(output_dir, f"frame_{frame_count:03d}.jpg")
-                cv2.imwrite(output_path, frame)
-                logger.debug(f"Frame guardado: {output_path}")
-                frame_count += 1
-            else:
-                logger.warning(f"No se pudo leer el frame {current_frame}")
-            
-            current_frame += frame_interval
+        while next_capture is not None and video.grab():
+            if current_frame == next_capture:
+                ret, frame = video.retrieve()
+                if not ret:
+                    logger.warning(f"No se pudo leer el frame {current_frame}")
+                else:
+                    frame_hash = _average_hash(frame)
+                    # Descartar las capturas casi idénticas a la última guardada (planos estáticos)
+                    if last_hash is not None and bin(frame_hash ^ last_hash).count('1') < _DUPLICATE_HASH_DISTANCE:
+                        logger.debug(f"Frame {current_frame} descartado por ser casi idéntico al anterior")
+                    else:
+                        # Guardar el frame como imagen
+                        output_path = os.path.join(output_dir, f"frame_{frame_count:03d}.jpg")
+                        cv2.imwrite(output_path, frame, _JPEG_PARAMS)
+                        logger.debug(f"Frame guardado: {output_path}")
+                        frame_count += 1
+                        last_hash = frame_hash
+                next_capture = next(targets, None)
+            current_frame += 1
         
         video.release()
-        logger.info(f"Extracción completada. Se extrajeron {frame_count} frames")
-        return True 
\ No newline at end of file
+        return frame_count
@@ -0,0 +1,372 @@
+import os
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import cv2
+from config.logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# PyAV es opcional: permite recodificar dentro del proceso, sin lanzar el ejecutable de FFmpeg
+try:
+    import av
+except ImportError:
+    av = None
+
+# Codificadores H.264 por hardware, en orden de preferencia
+HW_H264_ENCODERS = ("h264_nvenc", "h264_vaapi", "h264_qsv", "h264_videotoolbox")
+
+# Opciones de velocidad de cada codificador (vaapi y videotoolbox no admiten presets)
+_ENCODER_PRESETS = {
+    "libx264": ["-preset", "fast"],
+    "h264_nvenc": ["-preset", "p4"],
+    "h264_vaapi": [],
+    "h264_qsv": ["-preset", "fast"],
+    "h264_videotoolbox": [],
+}
+
+# Control de calidad constante de cada codificador cuando no se fija una tasa de bits
+_ENCODER_QUALITY = {
+    "libx264": ["-crf", "28"],
+    "h264_nvenc": ["-rc", "vbr", "-cq", "28"],
+    "h264_vaapi": ["-qp", "28"],
+}
+
+# Tasa de bits del audio en los videos reducidos (kbps)
+REDUCED_AUDIO_KBPS = 128
+
+# Bytes finales de stderr que se registran cuando FFmpeg falla
+STDERR_TAIL_BYTES = 4096
+
+@lru_cache(maxsize=1)
+def _available_encoders() -> frozenset:
+    """
+    Consulta una única vez los codificadores que admite el FFmpeg instalado
+
+    Returns:
+        frozenset: Nombres de los codificadores disponibles (vacío si FFmpeg no responde)
+    """
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+    except OSError as e:
+        logger.warning(f"No se pudo consultar los codificadores de FFmpeg: {str(e)}")
+        return frozenset()
+
+    # Cada línea tiene el formato " V....D nombre   descripción"
+    encoders = frozenset(
+        fields[1] for fields in (line.split() for line in result.stdout.decode(errors="replace").splitlines())
+        if len(fields) > 1
+    )
+    logger.debug("Codificadores H.264 por hardware disponibles: %s", [e for e in HW_H264_ENCODERS if e in encoders])
+    return encoders
+
+def _transcode_with_pyav(video_path: str, output_path: str, encoder: str, video_kbps: int,
+                         height: int, max_bytes: Optional[int], audio_kbps: int):
+    """
+    Recodifica el video con PyAV usando el codificador indicado
+    
+    Args:
+        video_path: Ruta al video original
+        output_path: Ruta del video recodificado
+        encoder: Nombre del codificador H.264
+        video_kbps: Tasa de bits objetivo del video
+        height: Altura máxima del video
+        max_bytes: Tamaño máximo de la salida en bytes, o None para no limitarlo
+        audio_kbps: Tasa de bits del audio
+    
+    Raises:
+        Exception: Cualquier error de PyAV al abrir, decodificar o codificar
+    """
+    with av.open(video_path) as source, av.open(output_path, "w") as output:
+        in_video = source.streams.video[0]
+        in_audio = source.streams.audio[0] if source.streams.audio else None
+
+        # Mismo resultado que el filtro "scale=-2:720": alto limitado y ancho par proporcional
+        out_height = min(height, in_video.height) // 2 * 2
+        out_width = max(2, round(in_video.width * out_height / in_video.height / 2) * 2)
+
+        # Las opciones equivalen a las de la línea de comandos ("-preset fast" -> {"preset": "fast"})
+        preset = _ENCODER_PRESETS.get(encoder, [])
+        options = {name.lstrip("-"): value for name, value in zip(preset[::2], preset[1::2])}
+        options.update(maxrate=f"{video_kbps}k", bufsize=f"{video_kbps // 2}k")
+
+        out_video = output.add_stream(encoder, rate=in_video.average_rate, options=options)
+        out_video.width = out_width
+        out_video.height = out_height
+        out_video.pix_fmt = "yuv420p"
+        out_video.bit_rate = video_kbps * 1000
+
+        streams = [in_video]
+        out_audio = None
+        if in_audio is not None:
+            out_audio = output.add_stream("aac", rate=in_audio.rate)
+            out_audio.bit_rate = audio_kbps * 1000
+            streams.append(in_audio)
+
+        written = 0
+        for packet in source.demux(*streams):
+            out_stream = out_video if packet.stream is in_video else out_audio
+            for frame in packet.decode():
+                if out_stream is out_video:
+                    frame = frame.reformat(width=out_width, height=out_height, format="yuv420p")
+                for out_packet in out_stream.encode(frame):
+                    written += out_packet.size
+                    output.mux(out_packet)
+            if max_bytes and written >= max_bytes:
+                logger.debug("Se alcanzó el tamaño máximo del video recodificado")
+                break
+
+        # Vaciar los codificadores
+        for out_stream in (out_video, out_audio):
+            if out_stream is not None:
+                for out_packet in out_stream.encode(None):
+                    output.mux(out_packet)
+
+class FFmpegService:
+    """Utilidades compartidas para recodificar videos con FFmpeg"""
+
+    @staticmethod
+    def get_h264_encoders() -> Tuple[str, ...]:
+        """
+        Codificadores H.264 a probar, del preferido al de respaldo
+
+        Un codificador por hardware puede estar compilado en FFmpeg sin que el equipo
+        tenga el dispositivo, por lo que libx264 siempre queda como última opción.
+
+        Returns:
+            Tuple[str, ...]: Codificadores por hardware disponibles seguidos de libx264
+        """
+        encoders = _available_encoders()
+        return tuple(e for e in HW_H264_ENCODERS if e in encoders) + ("libx264",)
+
+    @staticmethod
+    def get_encoder_args(encoder: str, video_kbps: Optional[int]) -> List[str]:
+        """
+        Argumentos de FFmpeg para codificar el video con el codificador indicado
+
+        Args:
+            encoder: Nombre del codificador H.264
+            video_kbps: Tasa de bits objetivo del video, o None para usar calidad constante
+
+        Returns:
+            List[str]: Argumentos de codificación de video
+        """
+        args = ["-c:v", encoder] + _ENCODER_PRESETS.get(encoder, [])
+        if video_kbps:
+            args += ["-b:v", f"{video_kbps}k"]
+        else:
+            args += _ENCODER_QUALITY.get(encoder, [])
+        return args
+
+    @staticmethod
+    def get_input_args(encoder: str) -> List[str]:
+        """
+        Argumentos de FFmpeg previos a la entrada para el codificador indicado
+
+        Con VAAPI el video también se decodifica en la GPU y los frames permanecen en
+        su memoria hasta el codificador.
+
+        Args:
+            encoder: Nombre del codificador H.264
+
+        Returns:
+            List[str]: Argumentos a colocar antes de "-i"
+        """
+        if encoder == "h264_vaapi":
+            return ["-hwaccel", "vaapi", "-hwaccel_output_format", "vaapi"]
+        return []
+
+    @staticmethod
+    def get_scale_filter(encoder: str, size: str) -> str:
+        """
+        Filtro de escalado adecuado para el codificador indicado
+
+        Args:
+            encoder: Nombre del codificador H.264
+            size: Dimensiones en formato "ancho:alto" (admite -1/-2 para mantener la proporción)
+
+        Returns:
+            str: Filtro de video de FFmpeg
+        """
+        if encoder == "h264_vaapi":
+            return f"scale_vaapi={size}"
+        return f"scale={size}"
+
+    @staticmethod
+    def transcode_in_process(video_path: str, output_path: str, video_kbps: int,
+                             height: int = 720, max_bytes: Optional[int] = None,
+                             audio_kbps: int = 128) -> bool:
+        """
+        Recodifica el video a H.264/AAC con PyAV, sin lanzar un proceso de FFmpeg
+        
+        Se prueban los codificadores disponibles en el mismo orden que con el ejecutable
+        (VAAPI se omite porque requiere subir los frames a la GPU). Como con "-fs", la
+        escritura se detiene al alcanzar max_bytes.
+        
+        Args:
+            video_path: Ruta al video original
+            output_path: Ruta del video recodificado
+            video_kbps: Tasa de bits objetivo del video
+            height: Altura máxima del video (se mantiene la proporción)
+            max_bytes: Tamaño máximo de la salida en bytes, o None para no limitarlo
+            audio_kbps: Tasa de bits del audio
+        
+        Returns:
+            bool: True si se generó el video, False si PyAV no está disponible o falló
+        """
+        if av is None:
+            return False
+
+        for encoder in FFmpegService.get_h264_encoders():
+            if encoder == "h264_vaapi":
+                continue
+            try:
+                _transcode_with_pyav(video_path, output_path, encoder, video_kbps, height, max_bytes, audio_kbps)
+                return True
+            except Exception as e:
+                logger.warning(f"Error al recodificar el video con PyAV y {encoder}: {type(e).__name__}: {str(e)}")
+        return False
+
+    @staticmethod
+    def stderr_tail(stderr: Optional[bytes], limit: int = STDERR_TAIL_BYTES) -> str:
+        """
+        Decodifica solo el final de la salida de error de FFmpeg para registrarla
+        
+        Args:
+            stderr: Salida de error capturada en binario
+            limit: Número máximo de bytes finales a conservar
+        
+        Returns:
+            str: Final de la salida de error, sin espacios sobrantes
+        """
+        if not stderr:
+            return ""
+        return stderr[-limit:].decode("utf-8", "replace").strip()
+
+    @staticmethod
+    def get_video_duration(video_path: str) -> Optional[float]:
+        """
+        Obtiene la duración del video a partir de sus metadatos
+
+        Args:
+            video_path: Ruta al archivo de video
+
+        Returns:
+            Optional[float]: Duración en segundos, o None si no se puede determinar
+        """
+        video = cv2.VideoCapture(video_path)
+        try:
+            if not video.isOpened():
+                return None
+            fps = video.get(cv2.CAP_PROP_FPS)
+            total_frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
+        finally:
+            video.release()
+
+        if fps <= 0 or total_frames <= 0:
+            return None
+        return total_frames / fps
+
+# Procesos dedicados a reducir videos en los análisis por lotes (la recodificación usa varios núcleos)
+REDUCE_WORKERS = 2
+
+def make_reduce_executor() -> ProcessPoolExecutor:
+    """
+    Crea el pool de procesos para reducir videos en los análisis por lotes
+    
+    Los procesos se crean con "spawn": hacer fork mientras otros hilos usan el cliente
+    gRPC de Gemini puede dejar bloqueado al proceso hijo.
+    
+    Returns:
+        ProcessPoolExecutor: Pool de REDUCE_WORKERS procesos
+    """
+    return ProcessPoolExecutor(max_workers=REDUCE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def reduce_video_size(video_path: str, max_size_mb: int = 10,
+                      current_size: Optional[int] = None, height: int = 720) -> Tuple[str, bool]:
+    """
+    Reduce el tamaño del video si es mayor que el tamaño máximo especificado
+    
+    Es la única implementación de la reducción, compartida por GeminiService y
+    VideoAnalysisService; es una función de módulo para que pueda ejecutarse en un
+    ProcessPoolExecutor.
+    
+    Args:
+        video_path: Ruta al archivo de video
+        max_size_mb: Tamaño máximo en MB
+        current_size: Tamaño del video en bytes, si ya se conoce
+        height: Altura máxima del video reducido (se mantiene la proporción)
+        
+    Returns:
+        Tuple[str, bool]: Ruta al video reducido y un booleano indicando si se redujo
+    """
+    if current_size is None:
+        current_size = os.stat(video_path).st_size
+    file_size = current_size / (1 << 20)  # Tamaño en MB
+    
+    if file_size <= max_size_mb:
+        logger.debug(f"El video ya está por debajo del tamaño máximo ({file_size:.2f} MB)")
+        return video_path, False
+    
+    # Crear nombre para el archivo reducido
+    base_name, ext = os.path.splitext(video_path)
+    reduced_path = f"{base_name}_reduced{ext}"
+    
+    # Calcular el bitrate objetivo (en kbps) para lograr el tamaño deseado
+    # Fórmula aproximada: bitrate = (tamaño_deseado_en_bits) / (duración_en_segundos)
+    try:
+        # Obtener la duración del video de sus metadatos, sin lanzar ffprobe
+        duration = FFmpegService.get_video_duration(video_path)
+        
+        if not duration:
+            logger.warning("No se pudo obtener la duración del video")
+            # Usar un bitrate bajo por defecto
+            target_bitrate_kbps = 500
+        else:
+            # Calcular bitrate objetivo (80% del máximo teórico para dejar margen)
+            target_bitrate_kbps = int((max_size_mb * 8 * 1024 * 0.8) / duration)
+        target_bitrate = f"{target_bitrate_kbps}k"
+            
+        logger.debug(f"Reduciendo video con bitrate objetivo: {target_bitrate}")
+        
+        # Con PyAV el video se recodifica dentro del proceso; si no está instalado o falla,
+        # se recurre al ejecutable de FFmpeg
+        if not FFmpegService.transcode_in_process(video_path, reduced_path, target_bitrate_kbps,
+                                                  height=height, max_bytes=max_size_mb << 20):
+            # Reducir el video probando primero los codificadores por hardware; libx264 queda como respaldo.
+            # -fs detiene la salida al alcanzar el tamaño máximo
+            for encoder in FFmpegService.get_h264_encoders():
+                cmd = ["ffmpeg", *FFmpegService.get_input_args(encoder), "-i", video_path,
+                       *FFmpegService.get_encoder_args(encoder, target_bitrate_kbps),
+                       "-maxrate", target_bitrate, "-bufsize", f"{int(target_bitrate_kbps/2)}k",
+                       "-vf", FFmpegService.get_scale_filter(encoder, f"-2:{height}"), 
+                       "-c:a", "aac", "-b:a", f"{REDUCED_AUDIO_KBPS}k", "-fs", f"{max_size_mb}M",
+                       "-loglevel", "error", "-nostats", "-y", reduced_path]
+                logger.debug(f"Reduciendo video con el codificador {encoder}")
+            
+                # stdout no se usa; stderr solo contiene errores y se captura en binario
+                result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                if result.returncode == 0:
+                    break
+                logger.warning(f"Error al reducir el video con {encoder}: {FFmpegService.stderr_tail(result.stderr)}")
+        
+            if result.returncode != 0:
+                logger.error("Error al reducir el video con todos los codificadores disponibles")
+                return video_path, False
+        
+        # Verificar el tamaño del archivo reducido
+        reduced_size = os.stat(reduced_path).st_size / (1 << 20)
+        logger.info(f"Video reducido de {file_size:.2f} MB a {reduced_size:.2f} MB")
+        
+        return reduced_path, True
+        
+    except Exception as e:
+        logger.error(f"Error al reducir el video: {str(e)}")
+        return video_path, False
@@ -1,23 +1,83 @@
 import os
-import base64
+import re
 import json
+import orjson
 import logging
-import traceback
 import time
-import subprocess
-from typing import Optional, Tuple
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from datetime import timedelta
+from typing import List, Optional
 
 import google.generativeai as genai
-from config.logging_config import setup_logger, log_api_error
+from google.generativeai import caching
+from google.api_core import exceptions as google_exceptions
+from config.settings import MAX_CONCURRENT_LINKS
+from config.logging_config import setup_logger, log_api_error, classify_api_error
 from config.llm_config import (
     LLM_PROVIDER, LLM_MODEL, GEMINI_API_KEY,
     LLM_TEMPERATURE, LLM_MAX_TOKENS, LLM_TOP_P, LLM_TOP_K,
-    VIDEO_ANALYSIS_PROMPT
+    LLM_PROMPT_CACHE_TTL, LLM_PROMPT_CACHE_MIN_TOKENS, VIDEO_ANALYSIS_PROMPT
 )
 from app.models.video_analysis_model import VideoAnalysis
+from app.services.ffmpeg_service import make_reduce_executor, reduce_video_size
 
 logger = setup_logger(__name__)
 
+# Tamaño máximo de un video enviado en línea (límite de las solicitudes de Gemini)
+INLINE_MAX_BYTES = 20 << 20
+
+# Campos requeridos en la respuesta JSON
+REQUIRED_FIELDS = (
+    "descripcion_original", "titulo_portada", "idea_video", "gancho_video", "acciones",
+    "dialogo", "musica", "expectativas_cumplidas", "caption_video"
+)
+
+# Mapeo de campos (por si el modelo usa nombres diferentes)
+FIELD_MAPPING = {
+    "titulo": "titulo_portada",
+    "gancho_inicial": "gancho_video",
+    "caption": "caption_video"
+}
+
+# Caracteres por token aproximados, para estimar el tamaño del prompt sin llamar a la API
+_CHARS_PER_TOKEN = 4
+
+# Errores con los que Gemini indica que la caché de contexto ya no existe (p. ej. porque expiró)
+_CACHE_GONE_ERRORS = (google_exceptions.NotFound, google_exceptions.PermissionDenied)
+
+# Hashtags por defecto si la respuesta no incluye ninguno
+DEFAULT_HASHTAGS = ("#BarentBarefoot", "#EntrenamientoNatural", "#CuerpoFuerte")
+
+# Hashtag dentro de un texto: '#' seguido de letras, dígitos o '_' (sin la puntuación que le siga)
+_HASHTAG_RE = re.compile(r'#\w+')
+
+_JSON_DECODER = json.JSONDecoder()
+
+def parse_json_object(text: str, start: int) -> dict:
+    """
+    Parsea el objeto JSON de la respuesta que empieza en la posición indicada
+    
+    Args:
+        text: Respuesta del modelo
+        start: Posición del primer '{'
+    
+    Returns:
+        dict: Objeto JSON parseado
+    
+    Raises:
+        json.JSONDecodeError: Si no hay un objeto JSON válido en esa posición
+    """
+    # Camino rápido: el objeto llega hasta el último '}' de la respuesta
+    end = text.rfind('}')
+    try:
+        return orjson.loads(text[start:end + 1])
+    except orjson.JSONDecodeError:
+        # raw_decode se detiene al cerrar el objeto, aunque después haya texto con llaves
+        obj, _ = _JSON_DECODER.raw_decode(text, start)
+        return obj
+
 # Silenciar logs innecesarios
 logging.getLogger("google.generativeai").setLevel(logging.ERROR)
 
@@ -42,67 +102,99 @@ class GeminiService:
         # Preparar el prompt template
         self.prompt_template = VIDEO_ANALYSIS_PROMPT
         
-    def _reduce_video_size(self, video_path: str, max_size_mb: int = 10) -> Tuple[str, bool]:
-        """Reduce el tamaño del video si es necesario"""
-        logger.debug(f"Verificando si es necesario reducir el tamaño del video: {video_path}")
+        # Cachear el prompt en Gemini para no reenviarlo con cada video
+        cached_content = self._create_prompt_cache()
         
-        # Obtener tamaño actual
-        file_size = os.path.getsize(video_path)
-        file_size_mb = file_size / (1024 * 1024)
+        # Cargar el modelo y la configuración de generación una sola vez (desde la caché de contexto si existe)
+        logger.debug(f"Cargando modelo Gemini: {self.model_name}")
+        if cached_content:
+            model = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+        else:
+            model = genai.GenerativeModel(self.model_name)
         
-        # Si el tamaño es aceptable, no hacer nada
-        if file_size_mb <= max_size_mb:
-            logger.debug(f"El tamaño del video ({file_size_mb:.2f} MB) es aceptable")
-            return video_path, False
-            
-        # Crear nombre para el archivo reducido
-        base_name, ext = os.path.splitext(video_path)
-        output_path = f"{base_name}_reduced{ext}"
+        # El modelo y su caché se guardan juntos en una tupla: los hilos que comparten el
+        # servicio los leen con una sola asignación y nunca ven una combinación incoherente
+        self._model_state = (model, cached_content)
+        self._model_lock = threading.Lock()
+        self._generation_config = genai.types.GenerationConfig(
+            temperature=LLM_TEMPERATURE,
+            top_p=LLM_TOP_P,
+            top_k=LLM_TOP_K,
+            max_output_tokens=LLM_MAX_TOKENS
+        )
+        
+    def _create_prompt_cache(self):
+        """
+        Crea una caché de contexto con el prompt de análisis como instrucción del sistema
+        
+        Returns:
+            CachedContent: Caché creada, o None si el modelo no la admite (p. ej. por
+            no alcanzar el mínimo de tokens cacheables); en ese caso el prompt se envía
+            en cada solicitud
+        """
+        # Gemini rechaza las cachés por debajo de un mínimo de tokens: no se gasta la llamada
+        estimated_tokens = len(self.prompt_template) // _CHARS_PER_TOKEN
+        if estimated_tokens < LLM_PROMPT_CACHE_MIN_TOKENS:
+            logger.debug(f"El prompt (~{estimated_tokens} tokens) no alcanza el mínimo cacheable "
+                         f"({LLM_PROMPT_CACHE_MIN_TOKENS}); se enviará en cada solicitud")
+            return None
         
         try:
-            # Usar ffmpeg para reducir el tamaño
-            logger.info(f"Reduciendo tamaño del video de {file_size_mb:.2f} MB a aproximadamente {max_size_mb} MB")
-            
-            # Comando para reducir el video
-            cmd = [
-                "ffmpeg", "-i", video_path, 
-                "-vf", "scale=640:-1",  # Reducir resolución
-                "-c:v", "libx264", "-crf", "28",  # Aumentar compresión
-                "-preset", "fast", 
-                "-y",  # Sobrescribir si existe
-                output_path
-            ]
-            
-            # Ejecutar comando
-            process = subprocess.Popen(
-                cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE
+            cached_content = caching.CachedContent.create(
+                model=self.model_name,
+                display_name="video_analysis_prompt",
+                system_instruction=self.prompt_template,
+                ttl=timedelta(seconds=LLM_PROMPT_CACHE_TTL)
             )
-            stdout, stderr = process.communicate()
-            
-            # Verificar resultado
-            if process.returncode != 0:
-                logger.error(f"Error al reducir el video: {stderr.decode()}")
-                return video_path, False
-                
-            # Verificar que el archivo se creó correctamente
-            if not os.path.exists(output_path):
-                logger.error(f"No se pudo crear el archivo reducido: {output_path}")
-                return video_path, False
-                
-            # Verificar el nuevo tamaño
-            new_size = os.path.getsize(output_path) / (1024 * 1024)
-            logger.info(f"Video reducido exitosamente. Nuevo tamaño: {new_size:.2f} MB")
-            
-            return output_path, True
-            
+            logger.debug(f"Caché de contexto creada: {cached_content.name}")
+            return cached_content
         except Exception as e:
-            logger.error(f"Error al reducir el video: {str(e)}")
-            return video_path, False
-    
-    def analyze_video(self, video_path: str, max_retries: int = 3) -> Optional[VideoAnalysis]:
-        """Analiza un video y genera recomendaciones usando Gemini API directamente"""
+            logger.debug(f"No se pudo crear la caché de contexto, se enviará el prompt en cada solicitud: {e}")
+            return None
+        
+    def _drop_prompt_cache(self, delete: bool = True):
+        """
+        Deja de usar la caché de contexto y vuelve al modelo sin caché
+        
+        Args:
+            delete: Si se debe borrar la caché en Gemini (no tiene sentido si ya expiró)
+        
+        Returns:
+            GenerativeModel: Modelo sin caché que deben usar las solicitudes siguientes
+        """
+        with self._model_lock:
+            model, cached_content = self._model_state
+            if cached_content is None:
+                # Otro hilo ya dejó de usar la caché
+                return model
+            model = genai.GenerativeModel(self.model_name)
+            self._model_state = (model, None)
+        
+        if delete:
+            try:
+                cached_content.delete()
+                logger.debug(f"Caché de contexto eliminada: {cached_content.name}")
+            except Exception as e:
+                logger.warning(f"No se pudo eliminar la caché de contexto {cached_content.name}: {str(e)}")
+        return model
+
+    def close(self):
+        """Libera los recursos creados en Gemini (la caché de contexto del prompt)"""
+        self._drop_prompt_cache()
+        
+    def analyze_video(self, video_path: str, max_retries: int = 3,
+                      reduce_executor: Optional[ProcessPoolExecutor] = None) -> Optional[VideoAnalysis]:
+        """
+        Analiza un video y genera recomendaciones usando Gemini API directamente
+        
+        Args:
+            video_path: Ruta al archivo de video
+            max_retries: Número máximo de reintentos
+            reduce_executor: Pool de procesos para reducir el video, o None para reducirlo en este hilo
+        
+        Returns:
+            Optional[VideoAnalysis]: Análisis del video, o None si no se pudo obtener
+        """
         logger.debug(f"Iniciando análisis de video con Gemini: {video_path}")
 
         # Verificar que el archivo existe
@@ -112,114 +204,176 @@ class GeminiService:
 
         # Obtener información del archivo
         file_size = os.path.getsize(video_path)
-        logger.debug(f"Tamaño del archivo de video: {file_size} bytes ({file_size / (1024 * 1024):.2f} MB)")
+        file_size_mb = file_size / (1 << 20)
+        logger.debug(f"Tamaño del archivo de video: {file_size} bytes ({file_size_mb:.2f} MB)")
 
         # Verificar si el archivo es demasiado grande y reducirlo si es necesario
-        if file_size > 15 * 1024 * 1024:  # 15 MB
-            logger.warning(f"El archivo de video es muy grande ({file_size / (1024 * 1024):.2f} MB). Intentando reducir.")
-            video_path, was_reduced = self._reduce_video_size(video_path)
+        # (con la API de archivos no aplica el límite de tamaño de las solicitudes en línea)
+        if file_size > 100 << 20:  # 100 MB
+            logger.warning(f"El archivo de video es muy grande ({file_size_mb:.2f} MB). Intentando reducir.")
+            if reduce_executor is not None:
+                video_path, was_reduced = reduce_executor.submit(reduce_video_size, video_path, 50, file_size).result()
+            else:
+                video_path, was_reduced = reduce_video_size(video_path, max_size_mb=50, current_size=file_size)
             if was_reduced:
                 file_size = os.path.getsize(video_path)
-                logger.info(f"Video reducido a {file_size / (1024 * 1024):.2f} MB")
+                logger.info(f"Video reducido a {file_size / (1 << 20):.2f} MB")
 
-        # Leer el archivo de video
+        # Subir el video una sola vez; todos los reintentos reutilizan el mismo archivo
+        try:
+            video_file = self.upload_video(video_path)
+        except Exception as e:
+            logger.error(f"Error al subir el video a Gemini: {type(e).__name__}: {str(e)}")
+            log_api_error(logger, e)
+            
+            # Alternativa: enviar el video dentro de la propia solicitud si cabe en ella
+            if file_size > INLINE_MAX_BYTES:
+                logger.error("El video supera el tamaño máximo para enviarlo en línea")
+                return None
+            logger.info("Enviando el video en línea como alternativa a la API de archivos")
+            return self._generate_analysis(self._read_inline_part(video_path, file_size), max_retries)
+
+        try:
+            return self._generate_analysis(video_file, max_retries)
+        finally:
+            # Liberar el almacenamiento del archivo subido
+            try:
+                genai.delete_file(video_file.name)
+                logger.debug(f"Archivo eliminado de Gemini: {video_file.name}")
+            except Exception as e:
+                logger.warning(f"No se pudo eliminar el archivo subido {video_file.name}: {str(e)}")
+
+    def analyze_videos(self, video_paths: List[str], max_concurrency: int = MAX_CONCURRENT_LINKS) -> List[Optional[VideoAnalysis]]:
+        """
+        Analiza varios videos en paralelo
+        
+        Las llamadas a Gemini pasan casi todo el tiempo esperando a la red, por lo que se
+        reparten entre hilos que comparten el modelo y la configuración creados en __init__.
+        Las reducciones de video (CPU) se ejecutan en un pool de procesos propio, de modo
+        que se solapan con las llamadas de los demás videos.
+        
+        Args:
+            video_paths: Rutas a los archivos de video
+            max_concurrency: Número máximo de análisis simultáneos
+        
+        Returns:
+            List[Optional[VideoAnalysis]]: Análisis de cada video, en el mismo orden que las rutas
+        """
+        logger.info(f"Analizando {len(video_paths)} videos con hasta {max_concurrency} en paralelo")
+        with make_reduce_executor() as reduce_executor, \
+                ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            analyze = partial(self.analyze_video, reduce_executor=reduce_executor)
+            return list(executor.map(analyze, video_paths))
+
+    @staticmethod
+    def _read_inline_part(video_path: str, file_size: int) -> dict:
+        """
+        Lee el video para enviarlo en línea en la solicitud
+        
+        Args:
+            video_path: Ruta al archivo de video
+            file_size: Tamaño del archivo en bytes
+        
+        Returns:
+            dict: Parte inline_data con los bytes del video
+        """
         logger.debug("Leyendo archivo de video")
+        # Con el tamaño conocido, read(n) reserva el buffer una sola vez en lugar de ir ampliándolo
         with open(video_path, "rb") as f:
-            video_data = f.read()
+            video_data = f.read(file_size)
+        return {"inline_data": {"mime_type": "video/mp4", "data": video_data}}
 
-        # Codificar el video en base64
-        logger.debug(f"Codificando video en base64 (tamaño: {len(video_data)} bytes)")
-        video_base64 = base64.b64encode(video_data).decode('utf-8')
-        logger.debug(f"Tamaño de la cadena base64: {len(video_base64)} caracteres")
+    @staticmethod
+    def upload_video(video_path: str, poll_interval: float = 2, timeout: float = 300):
+        """
+        Sube un video a la API de archivos de Gemini y espera a que esté listo para usarse
+        
+        Args:
+            video_path: Ruta al archivo de video
+            poll_interval: Segundos entre comprobaciones del estado del archivo
+            timeout: Segundos máximos de espera a que el archivo se procese
+        
+        Returns:
+            File: Archivo subido, en estado ACTIVE
+        """
+        logger.debug(f"Subiendo video a la API de archivos de Gemini: {video_path}")
+        video_file = genai.upload_file(path=video_path, mime_type="video/mp4")
+        
+        # Los videos se procesan de forma asíncrona tras la subida
+        deadline = time.monotonic() + timeout
+        while video_file.state.name == "PROCESSING":
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"El archivo {video_file.name} no terminó de procesarse en {timeout} segundos")
+            time.sleep(poll_interval)
+            video_file = genai.get_file(video_file.name)
+        
+        if video_file.state.name != "ACTIVE":
+            raise ValueError(f"El archivo {video_file.name} no está disponible (estado: {video_file.state.name})")
+        
+        logger.debug(f"Video subido a Gemini: {video_file.name}")
+        return video_file
 
+    def _generate_analysis(self, video_part, max_retries: int) -> Optional[VideoAnalysis]:
+        """
+        Solicita el análisis del video al modelo, con reintentos ante límites de cuota
+        
+        Args:
+            video_part: Parte de la solicitud con el video
+            max_retries: Número máximo de reintentos
+        
+        Returns:
+            Optional[VideoAnalysis]: Análisis del video, o None si no se pudo obtener
+        """
+        # Crear la solicitud con el video y el prompt (es la misma en todos los intentos)
+        parts = [video_part]
+        # El prompt solo se envía si no está en la caché de contexto
+        model, cached_content = self._model_state
+        uses_cache = cached_content is not None
+        if not uses_cache:
+            parts.append({"text": self.prompt_template})
+        
         # Implementar reintentos con backoff exponencial
         retry_count = 0
         while retry_count <= max_retries:
             try:
-                # Cargar el modelo de Gemini
-                logger.debug(f"Cargando modelo Gemini: {self.model_name}")
-                model = genai.GenerativeModel(self.model_name)
-                
-                # Crear objeto Part para el video
-                video_part = {"mime_type": "video/mp4", "data": base64.b64decode(video_base64)}
-                
-                # Preparar el prompt
-                prompt_text = self.prompt_template
-                
                 # Enviar la solicitud al modelo con el video y el prompt
                 logger.info(f"Enviando video al modelo Gemini para análisis (intento {retry_count + 1}/{max_retries + 1})")
                 
                 try:
-                    # Configurar parámetros de generación
-                    generation_config = genai.types.GenerationConfig(
-                        temperature=LLM_TEMPERATURE,
-                        top_p=LLM_TOP_P,
-                        top_k=LLM_TOP_K,
-                        max_output_tokens=LLM_MAX_TOKENS
-                    )
-                    
-                    # Crear la solicitud con el video y el prompt
-                    parts = [
-                        {
-                            "inline_data": {
-                                "mime_type": "video/mp4",
-                                "data": video_base64
-                            }
-                        },
-                        {
-                            "text": prompt_text
-                        }
-                    ]
-                    
                     # Enviar solicitud
                     response = model.generate_content(
                         parts,
-                        generation_config=generation_config
+                        generation_config=self._generation_config
                     )
                     
                     # Procesar la respuesta
                     cleaned_response = response.text
                     logger.debug(f"Respuesta original recibida: {cleaned_response[:200]}...")
                     
-                    # Extraer el JSON de la respuesta
-                    # Buscar el primer '{' y el último '}'
+                    # Extraer el JSON de la respuesta a partir del primer '{'
                     try:
                         start_idx = cleaned_response.find('{')
-                        end_idx = cleaned_response.rfind('}')
                         
-                        if start_idx >= 0 and end_idx > start_idx:
-                            # Extraer solo la parte JSON
-                            json_str = cleaned_response[start_idx:end_idx+1]
-                            logger.debug(f"JSON extraído: {json_str[:200]}...")
+                        if start_idx >= 0:
+                            logger.debug(f"JSON extraído: {cleaned_response[start_idx:start_idx + 200]}...")
                             
                             # Parsear el JSON
-                            json_response = json.loads(json_str)
+                            json_response = parse_json_object(cleaned_response, start_idx)
                             logger.debug("Análisis completado exitosamente")
                             
-                            # Verificar que el JSON tiene los campos requeridos
-                            required_fields = ["descripcion_original", "titulo_portada", "idea_video", "gancho_video", "acciones", 
-                                              "dialogo", "musica", "expectativas_cumplidas", "caption_video"]
-                            
-                            # Mapear campos si es necesario (por si el modelo usa nombres diferentes)
-                            field_mapping = {
-                                "titulo": "titulo_portada",
-                                "gancho_inicial": "gancho_video",
-                                "caption": "caption_video"
-                            }
-                            
                             # Aplicar mapeo de campos
-                            for old_field, new_field in field_mapping.items():
+                            for old_field, new_field in FIELD_MAPPING.items():
                                 if old_field in json_response and new_field not in json_response:
                                     json_response[new_field] = json_response.pop(old_field)
                             
                             # Verificar campos requeridos
-                            missing_fields = [field for field in required_fields if field not in json_response]
+                            missing_fields = [field for field in REQUIRED_FIELDS if field not in json_response]
                             if missing_fields:
                                 logger.warning(f"Faltan campos en la respuesta JSON: {missing_fields}")
                                 # Intentar completar campos faltantes con valores por defecto
                                 for field in missing_fields:
                                     if field == "hashtags":
-                                        json_response[field] = ["#BarentBarefoot", "#EntrenamientoNatural", "#CuerpoFuerte"]
+                                        json_response[field] = list(DEFAULT_HASHTAGS)
                                     else:
                                         json_response[field] = "No especificado"
                             
@@ -229,13 +383,13 @@ class GeminiService:
                                 if "caption_video" in json_response:
                                     # Buscar palabras que empiezan con #
                                     caption = json_response["caption_video"]
-                                    hashtags = [word for word in caption.split() if word.startswith("#")]
+                                    hashtags = _HASHTAG_RE.findall(caption)
                                     if hashtags:
                                         json_response["hashtags"] = hashtags
                                     else:
-                                        json_response["hashtags"] = ["#BarentBarefoot", "#EntrenamientoNatural", "#CuerpoFuerte"]
+                                        json_response["hashtags"] = list(DEFAULT_HASHTAGS)
                                 else:
-                                    json_response["hashtags"] = ["#BarentBarefoot", "#EntrenamientoNatural", "#CuerpoFuerte"]
+                                    json_response["hashtags"] = list(DEFAULT_HASHTAGS)
                             
                             # Devolver el resultado como objeto VideoAnalysis
                             return VideoAnalysis(**json_response)
@@ -251,13 +405,19 @@ class GeminiService:
                     
                 except Exception as e:
                     # Manejar errores específicos de la API
-                    logger.error(f"Error al invocar el modelo: {type(e).__name__}: {str(e)}")
-                    logger.error(f"Detalles del error: {traceback.format_exc()}")
+                    logger.exception(f"Error al invocar el modelo: {type(e).__name__}: {str(e)}")
                     log_api_error(logger, e)
                     
+                    # Si la caché de contexto expiró, se repite la solicitud una vez sin ella
+                    if uses_cache and isinstance(e, _CACHE_GONE_ERRORS):
+                        logger.warning("La caché de contexto del prompt ya no está disponible. Reintentando sin caché")
+                        model, uses_cache = self._drop_prompt_cache(delete=False), False
+                        parts.append({"text": self.prompt_template})
+                        continue
+                    
                     # Implementar lógica de reintento para límites de tasa y problemas de cuota
-                    error_str = str(e).lower()
-                    if "quota" in error_str or "rate limit" in error_str:
+                    error_category = classify_api_error(e)
+                    if error_category == "rate":
                         if retry_count < max_retries:
                             wait_time = (2 ** retry_count) * 5  # Backoff exponencial
                             logger.warning(f"Se ha alcanzado el límite de cuota. Reintentando en {wait_time} segundos...")
@@ -268,22 +428,17 @@ class GeminiService:
                             logger.error("Se ha alcanzado el límite de cuota de la API y se agotaron los reintentos")
                             return None  # Salir del bucle de reintentos
                     
-                    elif "too large" in error_str or "size limit" in error_str:
+                    elif error_category == "size":
                         logger.error("El video parece ser demasiado grande para la API")
                         break  # Salir del bucle de reintentos
                     
                     return None  # Devolver None si no es un error recuperable
                 
             except Exception as e:
-                logger.error(f"Error al preparar el mensaje: {type(e).__name__}: {str(e)}")
-                logger.error(f"Detalles del error: {traceback.format_exc()}")
+                logger.exception(f"Error al preparar el mensaje: {type(e).__name__}: {str(e)}")
                 log_api_error(logger, e)
                 return None
             
-            finally:
-                # Limpiar la cadena base64
-                video_base64 = None
-            
             # Si llegamos aquí sin continuar el bucle, salimos
             break
             
@@ -1,21 +1,26 @@
 import os
-import base64
+import json
+import random
+import asyncio
 import logging
-import traceback
-import time
-import subprocess
-from typing import Optional, Tuple
-from langchain.prompts import PromptTemplate
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+import google.generativeai as genai
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage
-from config.logging_config import setup_logger, log_api_error
+from pydantic import ValidationError
+from tenacity import AsyncRetrying, RetryError, Retrying, retry_if_exception, stop_after_attempt
+from config.settings import MAX_CONCURRENT_LINKS
+from config.logging_config import setup_logger, log_api_error, classify_api_error
 from config.llm_config import (
     LLM_PROVIDER, LLM_MODEL, GEMINI_API_KEY, OPENAI_API_KEY,
     LLM_TEMPERATURE, LLM_MAX_TOKENS, LLM_TOP_P, LLM_TOP_K,
     VIDEO_ANALYSIS_PROMPT
 )
 from app.models.video_analysis_model import VideoAnalysis
+from app.services.gemini_service import GeminiService, parse_json_object
+from app.services.ffmpeg_service import make_reduce_executor, reduce_video_size
 
 logger = setup_logger(__name__)
 
@@ -23,6 +28,172 @@ logger = setup_logger(__name__)
 logging.getLogger("langchain").setLevel(logging.ERROR)
 logging.getLogger("langchain_core").setLevel(logging.ERROR)
 
+# El prompt no tiene variables: se usa directamente como texto
+_PROMPT = VIDEO_ANALYSIS_PROMPT.strip()
+
+def _make_llm(provider: str, model: str):
+    """
+    Crea el cliente del modelo
+    
+    Cada servicio tiene su propio cliente: el cliente asíncrono de Gemini queda ligado al
+    bucle de eventos en el que se usa por primera vez, por lo que no puede compartirse
+    entre bucles distintos.
+    
+    Args:
+        provider: Proveedor del modelo ("gemini" u "openai")
+        model: Nombre del modelo
+    
+    Returns:
+        BaseChatModel: Cliente de LangChain para el modelo
+    """
+    if provider == "gemini":
+        logger.debug("Configurando modelo Gemini")
+        return ChatGoogleGenerativeAI(
+            model=model,
+            google_api_key=GEMINI_API_KEY,
+            temperature=LLM_TEMPERATURE,
+            top_p=LLM_TOP_P,
+            top_k=LLM_TOP_K,
+            max_output_tokens=LLM_MAX_TOKENS,
+            convert_system_message_to_human=True
+        )
+    elif provider == "openai":
+        logger.debug("Configurando modelo OpenAI")
+        return ChatOpenAI(
+            model=model,
+            openai_api_key=OPENAI_API_KEY,
+            temperature=LLM_TEMPERATURE,
+            max_tokens=LLM_MAX_TOKENS
+        )
+    else:
+        logger.error(f"Proveedor no soportado: {provider}")
+        raise ValueError(f"Proveedor no soportado: {provider}")
+
+# Códigos HTTP que indican un error transitorio (límite de tasa o sobrecarga del servidor)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 529}
+
+# Espera máxima entre reintentos (segundos), también para el valor de Retry-After
+MAX_RETRY_WAIT = 60
+
+def _status_code(error) -> Optional[int]:
+    """
+    Obtiene el código de estado HTTP de un error de API, si lo expone
+    
+    Args:
+        error: Excepción lanzada por el cliente del modelo
+    
+    Returns:
+        Optional[int]: Código de estado, o None si no se conoce
+    """
+    for code in (getattr(error, "status_code", None),
+                 getattr(getattr(error, "response", None), "status_code", None),
+                 getattr(error, "code", None)):
+        if isinstance(code, int):
+            return code
+    return None
+
+def _retry_wait_time(error, retry_count: int) -> float:
+    """
+    Calcula la espera antes del siguiente reintento
+    
+    Respeta la cabecera Retry-After si el proveedor la envía (hasta MAX_RETRY_WAIT); si no,
+    usa backoff exponencial con jitter para que los clientes no reintenten todos a la vez.
+    
+    Args:
+        error: Excepción lanzada por el cliente del modelo
+        retry_count: Número de reintentos realizados
+    
+    Returns:
+        float: Segundos de espera
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers:
+        try:
+            retry_after = headers.get("retry-after")
+            if retry_after:
+                # Un Retry-After enorme bloquearía al trabajador: se limita a la espera máxima
+                return min(MAX_RETRY_WAIT, max(0.0, float(retry_after))) + random.random()
+        except (TypeError, ValueError):
+            pass
+    
+    base = min(MAX_RETRY_WAIT, (2 ** retry_count) * 5)  # Backoff exponencial
+    return base * random.uniform(0.5, 1.5)
+
+class InvalidResponseError(ValueError):
+    """La respuesta del modelo no contiene un análisis JSON válido (se trata como error transitorio)"""
+
+def _is_retryable(error) -> bool:
+    """
+    Indica si un error del modelo es transitorio (límite de tasa, cuota, sobrecarga del servidor o respuesta no válida)
+    
+    Args:
+        error: Excepción lanzada por el cliente del modelo
+    
+    Returns:
+        bool: True si merece la pena reintentar la llamada
+    """
+    if isinstance(error, InvalidResponseError):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES or classify_api_error(error) == "rate"
+
+def _wait_before_retry(retry_state) -> float:
+    """
+    Estrategia de espera de tenacity basada en _retry_wait_time
+    
+    Args:
+        retry_state: Estado del reintento en curso
+    
+    Returns:
+        float: Segundos de espera
+    """
+    return _retry_wait_time(retry_state.outcome.exception(), retry_state.attempt_number - 1)
+
+def _describe_error(error) -> str:
+    """
+    Resume un error del modelo para los mensajes de reintento
+    
+    Args:
+        error: Excepción lanzada por el cliente del modelo
+    
+    Returns:
+        str: Tipo del error y, si lo expone, su código de estado HTTP
+    """
+    status_code = _status_code(error)
+    if status_code is not None:
+        return f"{type(error).__name__} (HTTP {status_code})"
+    return f"{type(error).__name__}: {str(error)[:200]}"
+
+def _log_retry(retry_state):
+    """
+    Registra la espera antes de un reintento
+    
+    Args:
+        retry_state: Estado del reintento en curso
+    """
+    error = retry_state.outcome.exception()
+    logger.warning(f"Error transitorio ({_describe_error(error)}). "
+                   f"Reintentando en {retry_state.next_action.sleep:.1f} segundos...")
+
+def _retry_policy(max_retries: int) -> dict:
+    """
+    Política de reintentos de las llamadas al modelo
+    
+    Args:
+        max_retries: Número máximo de reintentos
+    
+    Returns:
+        dict: Argumentos para Retrying / AsyncRetrying
+    """
+    return dict(
+        stop=stop_after_attempt(max_retries + 1),
+        wait=_wait_before_retry,
+        retry=retry_if_exception(_is_retryable),
+        before_sleep=_log_retry,
+    )
+
+# Tamaño a partir del cual el video se reduce antes de subirlo
+REDUCE_THRESHOLD_BYTES = 15 << 20
+
 class VideoAnalysisService:
     """Servicio para analizar videos usando modelos de lenguaje multimodales"""
     
@@ -42,209 +213,376 @@ class VideoAnalysisService:
             logger.error("API key de OpenAI no configurada")
             raise ValueError("API key de OpenAI no configurada")
         
-        # Configurar el modelo según el proveedor
+        # Configurar el modelo según el proveedor (el cliente se comparte entre instancias)
         if self.provider == "gemini":
-            logger.debug("Configurando modelo Gemini")
-            self.llm = ChatGoogleGenerativeAI(
-                model=self.model,
-                google_api_key=GEMINI_API_KEY,
-                temperature=LLM_TEMPERATURE,
-                top_p=LLM_TOP_P,
-                top_k=LLM_TOP_K,
-                max_output_tokens=LLM_MAX_TOKENS,
-                convert_system_message_to_human=True
-            )
+            # La API de archivos se usa para subir los videos
+            genai.configure(api_key=GEMINI_API_KEY)
+        self.llm = _make_llm(self.provider, self.model)
+        
+        # Bucle de eventos de la fachada síncrona analyze_videos; se reutiliza entre lotes
+        # porque el cliente asíncrono del modelo queda ligado al primer bucle que lo usa
+        self._loop = None
+        
+        # Parte del mensaje con el prompt, común a todas las solicitudes
+        self._message_prefix = [{"type": "text", "text": _PROMPT}]
+        # Sin video, el mensaje es idéntico en todas las solicitudes y se construye una sola vez
+        self._text_message = HumanMessage(content=self._message_prefix)
+        
+        logger.debug("Servicio inicializado correctamente")
+    
+    def analyze_video(self, video_path: str, max_retries: int = 3) -> Optional[VideoAnalysis]:
+        """Analiza un video y genera recomendaciones"""
+        logger.debug(f"Iniciando análisis de video: {video_path}")
+
+        # Verificar que el archivo existe y obtener su tamaño con una sola llamada a stat
+        try:
+            file_size = os.stat(video_path).st_size
+        except FileNotFoundError:
+            logger.error(f"No se encontró el archivo de video: {video_path}")
+            raise FileNotFoundError(f"No se encontró el archivo de video: {video_path}")
+
+        # Solo Gemini recibe el video; OpenAI no admite video como entrada
+        if self.provider != "gemini":
+            return self._analyze_with_retries(None, max_retries)
+
+        video_file = self._prepare_video(video_path, file_size)
+        if video_file is None:
+            return None
+
+        try:
+            return self._analyze_with_retries(video_file, max_retries)
+        finally:
+            self._delete_uploaded_file(video_file)
+
+    async def analyze_video_async(self, video_path: str, max_retries: int = 3,
+                                  reduce_executor: Optional[ProcessPoolExecutor] = None) -> Optional[VideoAnalysis]:
+        """
+        Versión asíncrona de analyze_video
+        
+        La reducción y la subida del video son bloqueantes y se ejecutan fuera del bucle de
+        eventos (la reducción en reduce_executor si se indica, o en el pool de hilos); la
+        llamada al modelo usa ainvoke.
+        
+        Args:
+            video_path: Ruta al archivo de video
+            max_retries: Número máximo de reintentos
+            reduce_executor: Pool de procesos para reducir el video, o None para usar hilos
+        
+        Returns:
+            Optional[VideoAnalysis]: Análisis del video, o None si no se pudo obtener
+        """
+        logger.debug(f"Iniciando análisis asíncrono de video: {video_path}")
+
+        # Verificar que el archivo existe y obtener su tamaño con una sola llamada a stat
+        try:
+            file_size = os.stat(video_path).st_size
+        except FileNotFoundError:
+            logger.error(f"No se encontró el archivo de video: {video_path}")
+            raise FileNotFoundError(f"No se encontró el archivo de video: {video_path}")
+
+        # Solo Gemini recibe el video; OpenAI no admite video como entrada
+        if self.provider != "gemini":
+            return await self._analyze_with_retries_async(None, max_retries)
+
+        loop = asyncio.get_running_loop()
+        logger.debug(f"Tamaño del archivo de video: {file_size} bytes ({file_size / (1 << 20):.2f} MB)")
+        if file_size > REDUCE_THRESHOLD_BYTES:
+            logger.warning(f"El archivo de video es muy grande ({file_size / (1 << 20):.2f} MB). Intentando reducir.")
+            # Mientras se recodifica este video, el resto de análisis siguen esperando al modelo
+            video_path, _ = await loop.run_in_executor(reduce_executor, reduce_video_size, video_path, 10, file_size)
+
+        video_file = await loop.run_in_executor(None, self._upload_video, video_path)
+        if video_file is None:
+            return None
+
+        try:
+            return await self._analyze_with_retries_async(video_file, max_retries)
+        finally:
+            await loop.run_in_executor(None, self._delete_uploaded_file, video_file)
+
+    async def analyze_videos_async(self, video_paths: List[str], max_concurrency: int = MAX_CONCURRENT_LINKS) -> List[Optional[VideoAnalysis]]:
+        """
+        Analiza varios videos de forma concurrente
+        
+        Las reducciones (CPU) se ejecutan en un pool de procesos propio y se solapan con las
+        llamadas al modelo (red) de los demás videos; el semáforo limita cuántos videos
+        están en curso a la vez.
+        
+        Args:
+            video_paths: Rutas a los archivos de video
+            max_concurrency: Número máximo de análisis simultáneos
+        
+        Returns:
+            List[Optional[VideoAnalysis]]: Análisis de cada video, en el mismo orden que las rutas
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        with make_reduce_executor() as reduce_executor:
+            async def bounded(video_path):
+                async with semaphore:
+                    try:
+                        return await self.analyze_video_async(video_path, reduce_executor=reduce_executor)
+                    except Exception as e:
+                        logger.error(f"Error al analizar el video {video_path}: {type(e).__name__}: {str(e)}")
+                        return None
+
+            return await asyncio.gather(*[bounded(video_path) for video_path in video_paths])
+
+    def analyze_videos(self, video_paths: List[str], max_concurrency: int = MAX_CONCURRENT_LINKS) -> List[Optional[VideoAnalysis]]:
+        """
+        Analiza varios videos de forma concurrente (fachada síncrona de analyze_videos_async)
+        
+        Args:
+            video_paths: Rutas a los archivos de video
+            max_concurrency: Número máximo de análisis simultáneos
+        
+        Returns:
+            List[Optional[VideoAnalysis]]: Análisis de cada video, en el mismo orden que las rutas
+        """
+        logger.info(f"Analizando {len(video_paths)} videos con hasta {max_concurrency} en paralelo")
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(self.analyze_videos_async(video_paths, max_concurrency))
+
+    def close(self):
+        """Cierra el bucle de eventos de analyze_videos, si se llegó a crear"""
+        if self._loop is not None:
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+            self._loop = None
+
+    def _prepare_video(self, video_path: str, file_size: int):
+        """
+        Reduce el video si es necesario y lo sube a la API de archivos de Gemini
+        
+        Args:
+            video_path: Ruta al archivo de video
+            file_size: Tamaño del video en bytes
+        
+        Returns:
+            File: Video subido, o None si no se pudo subir
+        """
+        logger.debug(f"Tamaño del archivo de video: {file_size} bytes ({file_size / (1 << 20):.2f} MB)")
+
+        # Verificar si el archivo es demasiado grande y reducirlo si es necesario
+        if file_size > REDUCE_THRESHOLD_BYTES:
+            logger.warning(f"El archivo de video es muy grande ({file_size / (1 << 20):.2f} MB). Intentando reducir.")
+            # reduce_video_size ya registra el tamaño del video reducido
+            video_path, _ = reduce_video_size(video_path, current_size=file_size)
+
+        return self._upload_video(video_path)
+
+    @staticmethod
+    def _upload_video(video_path: str):
+        """
+        Sube el video a la API de archivos de Gemini
+        
+        Args:
+            video_path: Ruta al archivo de video
+        
+        Returns:
+            File: Video subido, o None si no se pudo subir
+        """
+        # Con Gemini, el video se sube una sola vez a la API de archivos y el mensaje solo lleva su URI
+        try:
+            return GeminiService.upload_video(video_path)
+        except Exception as e:
+            logger.error(f"Error al subir el video a Gemini: {type(e).__name__}: {str(e)}")
+            log_api_error(logger, e)
+            return None
+
+    @staticmethod
+    def _delete_uploaded_file(video_file):
+        """
+        Libera el almacenamiento del archivo subido a Gemini
+        
+        Args:
+            video_file: Video subido a la API de archivos de Gemini
+        """
+        try:
+            genai.delete_file(video_file.name)
+            logger.debug(f"Archivo eliminado de Gemini: {video_file.name}")
+        except Exception as e:
+            logger.warning(f"No se pudo eliminar el archivo subido {video_file.name}: {str(e)}")
+
+    def _build_message(self, video_file) -> HumanMessage:
+        """
+        Prepara el mensaje para el modelo
+        
+        Args:
+            video_file: Video subido a la API de archivos de Gemini (None para OpenAI)
+        
+        Returns:
+            HumanMessage: Mensaje con el prompt y, para Gemini, la referencia al video
+        """
+        logger.debug("Preparando mensaje para el modelo")
+
+        if self.provider == "gemini":  # Use the lowercase attribute for comparison
+            message_content = self._message_prefix + [
+                {"type": "media", "file_uri": video_file.uri, "mime_type": "video/mp4"},
+            ]
         elif self.provider == "openai":
-            logger.debug("Configurando modelo OpenAI")
-            self.llm = ChatOpenAI(
-                model=self.model,
-                openai_api_key=OPENAI_API_KEY,
-                temperature=LLM_TEMPERATURE,
-                max_tokens=LLM_MAX_TOKENS
-            )
+            # Formato esperado por OpenAI (la API de OpenAI no admite video como entrada)
+            return self._text_message
         else:
             logger.error(f"Proveedor no soportado: {self.provider}")
             raise ValueError(f"Proveedor no soportado: {self.provider}")
+
+        # Create the HumanMessage
+        return HumanMessage(content=message_content)
+
+    def _log_invoke_error(self, error):
+        """
+        Registra un error al invocar el modelo
         
-        # Crear el prompt
-        self.prompt_template = PromptTemplate(
-            template=VIDEO_ANALYSIS_PROMPT,
-            input_variables=[]
-        )
-        logger.debug("Servicio inicializado correctamente")
-    
-    def _reduce_video_size(self, video_path: str, max_size_mb: int = 10) -> Tuple[str, bool]:
+        Args:
+            error: Excepción lanzada por el cliente del modelo
         """
-        Reduce el tamaño del video si es mayor que el tamaño máximo especificado
+        # Handle specific API errors
+        logger.exception(f"Error al invocar el modelo {self.provider}: {type(error).__name__}: {str(error)}")
+        log_api_error(logger, error)
+
+        if not _is_retryable(error) and classify_api_error(error) == "size":
+            logger.error("El video parece ser demasiado grande para la API")
+
+    @staticmethod
+    def _parse_response(response) -> VideoAnalysis:
+        """
+        Convierte la respuesta del modelo en un objeto VideoAnalysis
         
         Args:
-            video_path: Ruta al archivo de video
-            max_size_mb: Tamaño máximo en MB
-            
+            response: Mensaje devuelto por el modelo
+        
         Returns:
-            Tuple[str, bool]: Ruta al video reducido y un booleano indicando si se redujo
+            VideoAnalysis: Análisis del video
+        
+        Raises:
+            InvalidResponseError: Si la respuesta no contiene un JSON que cumpla el esquema
         """
-        file_size = os.path.getsize(video_path) / (1024 * 1024)  # Tamaño en MB
+        # Las respuestas de LangChain pueden venir divididas en partes (texto o diccionarios)
+        content = response.content
+        if isinstance(content, list):
+            content = "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+
+        # El modelo puede envolver el JSON en un bloque de código: se valida solo el objeto
+        start = content.find("{")
+        if start < 0:
+            logger.error(f"La respuesta del modelo no contiene un objeto JSON: {content[:500]}")
+            raise InvalidResponseError("La respuesta del modelo no contiene un objeto JSON")
+
+        try:
+            return VideoAnalysis.model_validate(parse_json_object(content, start))
+        except (json.JSONDecodeError, ValidationError) as e:
+            logger.error(f"Respuesta del modelo no válida: {type(e).__name__}: {str(e)}")
+            logger.error(f"Respuesta original: {content[:500]}")
+            raise InvalidResponseError(f"Respuesta del modelo no válida: {type(e).__name__}") from e
+
+    def _invoke_once(self, message) -> VideoAnalysis:
+        """
+        Realiza una única llamada al modelo
         
-        if file_size <= max_size_mb:
-            logger.debug(f"El video ya está por debajo del tamaño máximo ({file_size:.2f} MB)")
-            return video_path, False
+        Args:
+            message: Mensaje con el prompt y el video
         
-        # Crear nombre para el archivo reducido
-        base_name, ext = os.path.splitext(video_path)
-        reduced_path = f"{base_name}_reduced{ext}"
+        Returns:
+            VideoAnalysis: Análisis del video
         
-        # Calcular el bitrate objetivo (en kbps) para lograr el tamaño deseado
-        # Fórmula aproximada: bitrate = (tamaño_deseado_en_bits) / (duración_en_segundos)
+        Raises:
+            Exception: El error del cliente del modelo o InvalidResponseError, para que la
+            política de reintentos decida
+        """
         try:
-            # Obtener la duración del video
-            cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", 
-                   "default=noprint_wrappers=1:nokey=1", video_path]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                logger.warning(f"No se pudo obtener la duración del video: {result.stderr}")
-                # Usar un bitrate bajo por defecto
-                target_bitrate = "500k"
-            else:
-                duration = float(result.stdout.strip())
-                # Calcular bitrate objetivo (80% del máximo teórico para dejar margen)
-                target_bitrate_kbps = int((max_size_mb * 8 * 1024 * 0.8) / duration)
-                target_bitrate = f"{target_bitrate_kbps}k"
-                
-            logger.debug(f"Reduciendo video con bitrate objetivo: {target_bitrate}")
-            
-            # Reducir el video
-            cmd = ["ffmpeg", "-i", video_path, "-b:v", target_bitrate, "-maxrate", target_bitrate, 
-                   "-bufsize", f"{int(target_bitrate_kbps/2)}k", "-vf", "scale=-2:720", 
-                   "-c:a", "aac", "-b:a", "128k", "-y", reduced_path]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                logger.error(f"Error al reducir el video: {result.stderr}")
-                return video_path, False
-            
-            # Verificar el tamaño del archivo reducido
-            reduced_size = os.path.getsize(reduced_path) / (1024 * 1024)
-            logger.info(f"Video reducido de {file_size:.2f} MB a {reduced_size:.2f} MB")
-            
-            return reduced_path, True
-            
+            response = self.llm.invoke([message])
         except Exception as e:
-            logger.error(f"Error al reducir el video: {str(e)}")
-            return video_path, False
+            self._log_invoke_error(e)
+            raise
 
-    def analyze_video(self, video_path: str, max_retries: int = 3) -> Optional[VideoAnalysis]:
-        """Analiza un video y genera recomendaciones"""
-        logger.debug(f"Iniciando análisis de video: {video_path}")
+        logger.debug(f"Response content: {response.content}")
+        logger.debug("Análisis completado exitosamente")
+        return self._parse_response(response)
 
-        # Verificar que el archivo existe
-        if not os.path.exists(video_path):
-            logger.error(f"No se encontró el archivo de video: {video_path}")
-            raise FileNotFoundError(f"No se encontró el archivo de video: {video_path}")
+    async def _invoke_once_async(self, message) -> VideoAnalysis:
+        """
+        Versión asíncrona de _invoke_once, basada en ainvoke
+        
+        Args:
+            message: Mensaje con el prompt y el video
+        
+        Returns:
+            VideoAnalysis: Análisis del video
+        
+        Raises:
+            Exception: El error del cliente del modelo o InvalidResponseError, para que la
+            política de reintentos decida
+        """
+        try:
+            response = await self.llm.ainvoke([message])
+        except Exception as e:
+            self._log_invoke_error(e)
+            raise
 
-        # Obtener información del archivo
-        file_size = os.path.getsize(video_path)
-        logger.debug(f"Tamaño del archivo de video: {file_size} bytes ({file_size / (1024 * 1024):.2f} MB)")
+        logger.debug(f"Response content: {response.content}")
+        logger.debug("Análisis completado exitosamente")
+        return self._parse_response(response)
 
-        # Verificar si el archivo es demasiado grande y reducirlo si es necesario
-        if file_size > 15 * 1024 * 1024:  # 15 MB
-            logger.warning(f"El archivo de video es muy grande ({file_size / (1024 * 1024):.2f} MB). Intentando reducir.")
-            video_path, was_reduced = self._reduce_video_size(video_path)
-            if was_reduced:
-                file_size = os.path.getsize(video_path)
-                logger.info(f"Video reducido a {file_size / (1024 * 1024):.2f} MB")
-
-        # Leer el archivo de video
-        logger.debug("Leyendo archivo de video")
-        with open(video_path, "rb") as f:
-            video_data = f.read()
-
-        # Codificar el video en base64
-        logger.debug(f"Codificando video en base64 (tamaño: {len(video_data)} bytes)")
-        video_base64 = base64.b64encode(video_data).decode('utf-8')
-        logger.debug(f"Tamaño de la cadena base64: {len(video_base64)} caracteres")
-
-        # Implementar reintentos con backoff exponencial
-        retry_count = 0
-        while retry_count <= max_retries:
-            try:
-                # Preparar el mensaje con el video
-                logger.debug("Preparando mensaje para el modelo")
-
-                if self.provider == "gemini":  # Use the lowercase attribute for comparison
-                    message_content = [
-                        {"type": "text", "text": self.prompt_template.format()},
-                        #{"type": "image_url", "image_url": {"url": f"data:video/mp4;base64,{video_base64}"}},
-                    ]
-                elif self.provider == "openai":
-                    # Formato esperado por OpenAI
-                    message_content = [
-                        {"type": "text", "text": self.prompt_template.format()},
-                        # {
-                        #     "type": "image_url",
-                        #     "image_url": {
-                        #         "url": f"data:video/mp4;base64,{video_base64}",
-                        #     },
-                        # },
-                    ]
-                else:
-                    logger.error(f"Proveedor no soportado: {self.provider}")
-                    raise ValueError(f"Proveedor no soportado: {self.provider}")
-
-                # Create the HumanMessage
-                message = HumanMessage(content=message_content)
-
-                # Obtener respuesta del modelo
-                logger.info(f"Enviando video al modelo {self.provider} para análisis (intento {retry_count + 1}/{max_retries + 1})")
-
-                try:
-                    # Invoke the LLM
-                    response = self.llm.invoke([message])
-
-                    # Print content of the response
-                    logger.debug(f"Response content: {response.content}")
-
-                    # Log raw response and return if successful
-                    logger.debug("Análisis completado exitosamente")
-
-                    return VideoAnalysis(result=response.content)
-
-                except Exception as e:
-                    # Handle specific API errors
-                    logger.error(f"Error al invocar el modelo: {type(e).__name__}: {str(e)}")
-                    logger.error(f"Detalles del error: {traceback.format_exc()}")
-                    log_api_error(logger, e)
-
-                    # Implement retry logic for rate limits and quota issues
-                    error_str = str(e).lower()
-                    if "quota" in error_str or "rate limit" in error_str:
-                        if retry_count < max_retries:
-                            wait_time = (2 ** retry_count) * 5  # Exponential backoff
-                            logger.warning(f"Se ha alcanzado el límite de cuota. Reintentando en {wait_time} segundos...")
-                            time.sleep(wait_time)
-                            retry_count += 1
-                            continue  # Retry the API call
-                        else:
-                            logger.error("Se ha alcanzado el límite de cuota de la API y se agotaron los reintentos")
-                            return None  # Exit retry loop
-
-                    elif "too large" in error_str or "size limit" in error_str:
-                        logger.error("El video parece ser demasiado grande para la API")
-                        # You could potentially try reducing the video further here if possible
-                        break  # Exit retry loop
-
-                    return None  # Return None if not a recoverable error
-
-            except Exception as e:
-                logger.error(f"Error al preparar el mensaje: {type(e).__name__}: {str(e)}")
-                logger.error(f"Detalles del error: {traceback.format_exc()}")
-                log_api_error(logger, e)
-                return None
-
-            finally:
-                # Clean up base64 string
-                video_base64 = None
-
-        return None
\ No newline at end of file
+    def _analyze_with_retries(self, video_file, max_retries: int) -> Optional[VideoAnalysis]:
+        """
+        Envía el mensaje al modelo, con reintentos ante límites de cuota y errores transitorios
+        
+        Args:
+            video_file: Video subido a la API de archivos de Gemini (None para OpenAI)
+            max_retries: Número máximo de reintentos
+        
+        Returns:
+            Optional[VideoAnalysis]: Análisis del video, o None si no se pudo obtener
+        """
+        try:
+            message = self._build_message(video_file)
+        except Exception as e:
+            logger.exception(f"Error al preparar el mensaje: {type(e).__name__}: {str(e)}")
+            log_api_error(logger, e)
+            return None
+
+        try:
+            for attempt in Retrying(**_retry_policy(max_retries)):
+                with attempt:
+                    logger.info(f"Enviando video al modelo {self.provider} para análisis "
+                                f"(intento {attempt.retry_state.attempt_number}/{max_retries + 1})")
+                    return self._invoke_once(message)
+        except RetryError as e:
+            last_error = e.last_attempt.exception()
+            logger.error(f"Se agotaron los reintentos. Último error: {_describe_error(last_error)}")
+        except Exception:
+            pass  # Error no recuperable, ya registrado en _invoke_once
+        return None
+
+    async def _analyze_with_retries_async(self, video_file, max_retries: int) -> Optional[VideoAnalysis]:
+        """
+        Versión asíncrona de _analyze_with_retries
+        
+        Args:
+            video_file: Video subido a la API de archivos de Gemini (None para OpenAI)
+            max_retries: Número máximo de reintentos
+        
+        Returns:
+            Optional[VideoAnalysis]: Análisis del video, o None si no se pudo obtener
+        """
+        try:
+            message = self._build_message(video_file)
+        except Exception as e:
+            logger.exception(f"Error al preparar el mensaje: {type(e).__name__}: {str(e)}")
+            log_api_error(logger, e)
+            return None
+
+        try:
+            async for attempt in AsyncRetrying(**_retry_policy(max_retries)):
+                with attempt:
+                    logger.info(f"Enviando video al modelo {self.provider} para análisis "
+                                f"(intento {attempt.retry_state.attempt_number}/{max_retries + 1})")
+                    return await self._invoke_once_async(message)
+        except RetryError as e:
+            last_error = e.last_attempt.exception()
+            logger.error(f"Se agotaron los reintentos. Último error: {_describe_error(last_error)}")
+        except Exception:
+            pass  # Error no recuperable, ya registrado en _invoke_once_async
+        return None
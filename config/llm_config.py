@@ -17,6 +17,12 @@ LLM_MAX_TOKENS = 8192
 LLM_TOP_P = 0.95
 LLM_TOP_K = 40
 
+# Tiempo de vida (en segundos) de la caché de contexto con el prompt de análisis
+LLM_PROMPT_CACHE_TTL = 3600
+
+# Mínimo de tokens que Gemini admite en una caché de contexto (por debajo no se intenta crearla)
+LLM_PROMPT_CACHE_MIN_TOKENS = int(os.getenv("LLM_PROMPT_CACHE_MIN_TOKENS", "4096"))
+
 # Configuración de prompts
 VIDEO_ANALYSIS_PROMPT = """
 Quiero inspirarme en el video adjuntado para crear un video para mi empresa "Barent Barefoot" que tiene el siguiente posicionamiento: ENTRENAMIENTO NATURAL PARA UN CUERPO FUERTE Y SALUDABLE
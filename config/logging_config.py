@@ -1,5 +1,6 @@
 import logging
 import os
+import re
 from datetime import datetime
 
 # Niveles de logging disponibles
@@ -21,42 +22,88 @@ LOG_DIR = 'logs'
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
+def _build_handler(handler, numeric_level):
+    """
+    Aplica el nivel y el formato comunes a un handler
+    
+    Args:
+        handler: Handler de logging a configurar
+        numeric_level: Nivel mínimo de los mensajes que emite
+    
+    Returns:
+        logging.Handler: El mismo handler configurado
+    """
+    handler.setLevel(numeric_level)
+    handler.setFormatter(_FORMATTER)
+    return handler
+
+# Obtener el nivel de log de la variable de entorno o usar el valor por defecto
+_NUMERIC_LEVEL = LOG_LEVELS.get(os.getenv('LOG_LEVEL', DEFAULT_LOG_LEVEL).upper(), LOG_LEVELS[DEFAULT_LOG_LEVEL])
+_FORMATTER = logging.Formatter(LOG_FORMAT, DATE_FORMAT)
+
+# Handlers únicos del proceso (consola y archivo), compartidos por todos los loggers a través
+# del logger raíz. El raíz mantiene su nivel por defecto (WARNING) para no mostrar los mensajes
+# informativos de librerías de terceros; el nivel configurado se aplica en setup_logger.
+_CONSOLE = _build_handler(logging.StreamHandler(), _NUMERIC_LEVEL)
+_FILE = _build_handler(
+    logging.FileHandler(os.path.join(LOG_DIR, f'app_{datetime.now().strftime("%Y%m%d")}.log'), encoding='utf-8'),
+    _NUMERIC_LEVEL
+)
+logging.getLogger().addHandler(_CONSOLE)
+logging.getLogger().addHandler(_FILE)
+
 def setup_logger(name):
     """
     Configura y devuelve un logger con el nombre especificado
     
+    Los mensajes se propagan a los handlers compartidos del logger raíz, por lo que
+    no se crea ningún handler ni descriptor de archivo por logger.
+    
     Args:
         name: Nombre del logger (normalmente __name__)
     
     Returns:
         logging.Logger: Logger configurado
     """
-    # Obtener el nivel de log de la variable de entorno o usar el valor por defecto
-    log_level = os.getenv('LOG_LEVEL', DEFAULT_LOG_LEVEL).upper()
-    numeric_level = LOG_LEVELS.get(log_level, LOG_LEVELS[DEFAULT_LOG_LEVEL])
-    
-    # Crear el logger
     logger = logging.getLogger(name)
-    logger.setLevel(numeric_level)
+    logger.setLevel(_NUMERIC_LEVEL)
+    return logger
+
+# Tipos de error de API reconocibles en el mensaje de la excepción, en orden de prioridad:
+# si el mensaje encaja con varios, gana el primero (p. ej. "request format: quota exceeded" es 'rate')
+_API_ERROR_PATTERNS = (
+    ('size', re.compile(r'too large|size limit', re.IGNORECASE)),
+    ('rate', re.compile(r'rate limit|quota', re.IGNORECASE)),
+    ('format', re.compile(r'\bformat\b', re.IGNORECASE)),
+    ('auth', re.compile(r'auth', re.IGNORECASE)),
+    ('timeout', re.compile(r'timeout', re.IGNORECASE)),
+    ('connection', re.compile(r'connection', re.IGNORECASE)),
+)
+
+_API_ERROR_MESSAGES = {
+    'size': "Posible error de tamaño de archivo excedido",
+    'rate': "Posible error de límite de tasa o cuota excedida",
+    'format': "Posible error de formato no soportado",
+    'auth': "Posible error de autenticación",
+    'timeout': "Posible error de tiempo de espera agotado",
+    'connection': "Posible error de conexión",
+}
+
+def classify_api_error(error):
+    """
+    Clasifica un error de API según su mensaje
     
-    # Evitar duplicación de handlers
-    if not logger.handlers:
-        # Handler para consola
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(numeric_level)
-        console_formatter = logging.Formatter(LOG_FORMAT, DATE_FORMAT)
-        console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
-        
-        # Handler para archivo
-        log_file = os.path.join(LOG_DIR, f'app_{datetime.now().strftime("%Y%m%d")}.log')
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        file_handler.setLevel(numeric_level)
-        file_formatter = logging.Formatter(LOG_FORMAT, DATE_FORMAT)
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+    Args:
+        error: Excepción lanzada por el cliente de la API
     
-    return logger 
+    Returns:
+        str: 'size', 'rate', 'format', 'auth', 'timeout' o 'connection', o None si no se reconoce
+    """
+    message = str(error)
+    for category, pattern in _API_ERROR_PATTERNS:
+        if pattern.search(message):
+            return category
+    return None
 
 # Añadir esta función para facilitar el diagnóstico
 def log_api_error(logger, error):
@@ -92,17 +139,7 @@ def log_api_error(logger, error):
     if hasattr(error, 'code'):
         logger.error(f"Código de error: {error.code}")
     
-    # Para errores de límite de tamaño
-    error_str = str(error).lower()
-    if 'too large' in error_str or 'size limit' in error_str:
-        logger.error("Posible error de tamaño de archivo excedido")
-    elif 'rate limit' in error_str or 'quota' in error_str:
-        logger.error("Posible error de límite de tasa o cuota excedida")
-    elif 'format' in error_str:
-        logger.error("Posible error de formato no soportado")
-    elif 'authentication' in error_str or 'auth' in error_str:
-        logger.error("Posible error de autenticación")
-    elif 'timeout' in error_str:
-        logger.error("Posible error de tiempo de espera agotado")
-    elif 'connection' in error_str:
-        logger.error("Posible error de conexión") 
\ No newline at end of file
+    # Tipo probable del error según su mensaje
+    category = classify_api_error(error)
+    if category:
+        logger.error(_API_ERROR_MESSAGES[category]) 
\ No newline at end of file
@@ -8,6 +8,11 @@ load_dotenv()
 # Configuración de captura de video
 CAPTURE_INTERVAL = 3  # Intervalo en segundos entre capturas
 
+# Configuración de procesamiento
+MAX_CONCURRENT_LINKS = int(os.getenv("MAX_CONCURRENT_LINKS", "8"))  # Número máximo de enlaces procesados en paralelo
+# El análisis multimodal usa el audio incluido en el video; el MP3 aparte solo se genera si se pide
+EXTRACT_AUDIO = os.getenv("EXTRACT_AUDIO", "false").lower() in ("1", "true", "yes")
+
 # Configuración de rutas
 INPUT_DIR = "data/input"
 OUTPUT_DIR = "data/output"
@@ -29,7 +29,10 @@ def main():
     
     # Iniciar el controlador y procesar los enlaces
     controller = ContentController()
-    controller.process_links_file(input_file, OUTPUT_DIR)
+    try:
+        controller.process_links_file(input_file, OUTPUT_DIR)
+    finally:
+        controller.close()
     
     print("\n=== Proceso de generación de contenido completado ===")
 
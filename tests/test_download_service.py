@@ -0,0 +1,65 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+class FakeDownloadError(Exception):
+    pass
+
+class FakeYoutubeDL:
+    """Sustituye a YoutubeDL: falla con cookies del navegador y funciona con credenciales"""
+    calls = []
+
+    def __init__(self, opts):
+        self.opts = opts
+        FakeYoutubeDL.calls.append(opts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def download(self, urls):
+        if self.opts.get("ignoreerrors"):
+            # Comportamiento real con ignoreerrors: solo registra el error y devuelve 1
+            return 1
+        if self.opts.get("cookiesfrombrowser"):
+            raise FakeDownloadError("ERROR: [Instagram] abc: An error has occurred (permission denied)")
+        return 0
+
+@pytest.fixture
+def download_service(monkeypatch):
+    yt_dlp = types.ModuleType("yt_dlp")
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+    yt_dlp.parse_options = lambda args: types.SimpleNamespace(
+        ydl_opts={"cookiesfrombrowser": ("chrome",), "ignoreerrors": "only_download"}
+    )
+    yt_dlp_utils = types.ModuleType("yt_dlp.utils")
+    yt_dlp_utils.DownloadError = FakeDownloadError
+    yt_dlp.utils = yt_dlp_utils
+    monkeypatch.setitem(sys.modules, "yt_dlp", yt_dlp)
+    monkeypatch.setitem(sys.modules, "yt_dlp.utils", yt_dlp_utils)
+    monkeypatch.delitem(sys.modules, "app.services.download_service", raising=False)
+
+    module = importlib.import_module("app.services.download_service")
+    monkeypatch.setattr(module, "INSTAGRAM_USERNAME", "usuario")
+    monkeypatch.setattr(module, "INSTAGRAM_PASSWORD", "secreto")
+    FakeYoutubeDL.calls = []
+    yield module
+    sys.modules.pop("app.services.download_service", None)
+
+def test_failed_instagram_download_uses_alternative_auth(download_service):
+    success = download_service.DownloadService._run_with_fallback(
+        "https://www.instagram.com/reel/abc/",
+        ["yt-dlp", "--cookies-from-browser", "chrome"],
+        "descarga", "Descarga completada", "Error en la descarga"
+    )
+
+    assert success
+    assert len(FakeYoutubeDL.calls) == 2
+    assert all(opts["ignoreerrors"] is False for opts in FakeYoutubeDL.calls)
+    alt_opts = FakeYoutubeDL.calls[1]
+    assert alt_opts["cookiesfrombrowser"] is None
+    assert (alt_opts["username"], alt_opts["password"]) == ("usuario", "secreto")
@@ -0,0 +1,17 @@
+import pytest
+from config.logging_config import classify_api_error
+
+@pytest.mark.parametrize("message, expected", [
+    ("429 Quota exceeded", "rate"),
+    ("For more information see https://ai.google.dev/gemini-api/docs/rate-limits; "
+     "You exceeded your current quota", "rate"),
+    ("Invalid request format: quota exceeded", "rate"),
+    ("Connection aborted while rate limit applied", "rate"),
+    ("Timeout: request too large", "size"),
+    ("Unsupported file format", "format"),
+    ("Missing information in request", None),
+    ("Authentication failed", "auth"),
+    ("ok", None),
+])
+def test_classify_api_error_uses_priority_order(message, expected):
+    assert classify_api_error(Exception(message)) == expected